@@ -1,27 +1,185 @@
+/**
+ * Parse a binary mesh asset written by `curvature.py --format binary`.
+ *
+ * The file starts with a little-endian uint32 header length, followed by a
+ * JSON header giving the dtype, count, components and offset (from the end of
+ * the header) of each buffer. Buffers are returned as typed-array views into
+ * the original ArrayBuffer, without copying.
+ *
+ * Quantized buffers (`curvature.py --quantize`) are decoded to Float32Arrays:
+ * "octahedral" unit vectors from int16 pairs, "fixed" positions from uint16
+ * within the box given by the buffer's min and max.
+ *
+ * Assets with levels of detail (`curvature.py --lods`) list the buffers of
+ * each level under `header.levels`; the finest level is returned here, see
+ * streamMeshLevels for progressive loading.
+ */
+export function parseMeshBuffer(buffer) {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength))
+  );
+  const levels = headerLevels(header);
+  return meshFromBuffers(buffer, 4 + headerLength, levels[levels.length - 1]);
+}
+
+/**
+ * Read a binary mesh asset from a fetch() response while it downloads,
+ * yielding each level of detail (coarse to fine) as soon as its bytes have
+ * arrived. Single-level assets yield one mesh once complete.
+ */
+export async function* streamMeshLevels(response) {
+  const reader = response.body.getReader();
+  const chunks = [];
+  let received = 0;
+  let bytes, levels, dataOffset;
+  let next = 0;
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    if (bytes) {
+      // ignore anything past the last buffer, such as trailing padding
+      const chunk = value.subarray(0, bytes.length - received);
+      bytes.set(chunk, received);
+      received += chunk.length;
+    } else {
+      chunks.push(value);
+      received += value.length;
+      if (received < 4) continue;
+      const head = concatChunks(chunks, received);
+      const headerLength = new DataView(head.buffer).getUint32(0, true);
+      if (received < 4 + headerLength) continue;
+      const header = JSON.parse(
+        new TextDecoder().decode(head.subarray(4, 4 + headerLength))
+      );
+      levels = headerLevels(header);
+      dataOffset = 4 + headerLength;
+      const last = levels[levels.length - 1];
+      bytes = new Uint8Array(dataOffset + last.offset + last.length);
+      bytes.set(head.subarray(0, bytes.length));
+      received = Math.min(received, bytes.length);
+    }
+    while (
+      next < levels.length &&
+      received >= dataOffset + levels[next].offset + levels[next].length
+    ) {
+      yield meshFromBuffers(bytes.buffer, dataOffset, levels[next]);
+      next++;
+    }
+  }
+}
+
+/** Levels listed in a header, or the whole asset as a single level. */
+function headerLevels(header) {
+  if (header.levels) return header.levels;
+  let length = 0;
+  for (const info of Object.values(header.buffers)) {
+    const bytes = ARRAY_TYPES[info.dtype].BYTES_PER_ELEMENT;
+    length = Math.max(
+      length,
+      info.offset + bytes * info.count * info.components
+    );
+  }
+  return [{ offset: 0, length, buffers: header.buffers }];
+}
+
+function concatChunks(chunks, length) {
+  const bytes = new Uint8Array(length);
+  let offset = 0;
+  for (const chunk of chunks) {
+    bytes.set(chunk, offset);
+    offset += chunk.length;
+  }
+  return bytes;
+}
+
+const ARRAY_TYPES = {
+  float32: Float32Array,
+  uint32: Uint32Array,
+  uint16: Uint16Array,
+  int16: Int16Array,
+};
+
+function meshFromBuffers(buffer, dataOffset, level) {
+  const mesh = {};
+  for (const [name, info] of Object.entries(level.buffers)) {
+    const ArrayType = ARRAY_TYPES[info.dtype];
+    const offset = dataOffset + info.offset;
+    const data = new ArrayType(buffer, offset, info.count * info.components);
+    if (info.encoding === "octahedral") {
+      mesh[name] = decodeOctahedral(data);
+    } else if (info.encoding === "fixed") {
+      mesh[name] = decodeFixed(data, info.min, info.max);
+    } else {
+      mesh[name] = data;
+    }
+  }
+  return mesh;
+}
+
+function decodeOctahedral(data) {
+  const out = new Float32Array((data.length / 2) * 3);
+  for (let i = 0, j = 0; i < data.length; i += 2, j += 3) {
+    let x = data[i] / 32767;
+    let y = data[i + 1] / 32767;
+    const z = 1 - Math.abs(x) - Math.abs(y);
+    const t = Math.max(-z, 0);
+    x += x >= 0 ? -t : t;
+    y += y >= 0 ? -t : t;
+    const length = Math.hypot(x, y, z);
+    out[j] = x / length;
+    out[j + 1] = y / length;
+    out[j + 2] = z / length;
+  }
+  return out;
+}
+
+function decodeFixed(data, min, max) {
+  const out = new Float32Array(data.length);
+  const components = min.length;
+  for (let i = 0; i < data.length; i++) {
+    const c = i % components;
+    out[i] = min[c] + (data[i] / 65535) * (max[c] - min[c]);
+  }
+  return out;
+}
+
+/** Flatten a nested array into a typed array (typed arrays are kept). */
+function flatArray(data, ArrayType) {
+  return ArrayBuffer.isView(data) ? data : ArrayType.from(data.flat());
+}
+
 /**
  * Load a mesh, returning an expanded form with calculated attributes.
  *
  * Each vertex in the mesh is duplicated n times, where n is the number of
  * triangles adjacent to that vertex. Each triangle consists of three vertices
  * labeled A/B/C, which are unique to that triangle.
+ *
+ * The mesh may come from a JSON asset (nested arrays) or from parseMeshBuffer
+ * (flat typed arrays, read in place). Attributes are flat Float32Arrays.
  */
 export function loadMesh(mesh) {
-  const elements = [];
-  const position = [];
-  const normal = [];
-  const curvature = [];
-  const indexInTriangle = [];
-  for (const [a, b, c] of mesh.triangles) {
-    const n = position.length;
-    elements.push(n, n + 1, n + 2);
-    position.push(mesh.positions[a], mesh.positions[b], mesh.positions[c]);
-    normal.push(mesh.normals[a], mesh.normals[b], mesh.normals[c]);
-    curvature.push(
-      mesh.curvature_min[a],
-      mesh.curvature_min[b],
-      mesh.curvature_min[c]
-    );
-    indexInTriangle.push(0, 1, 2);
+  const triangles = flatArray(mesh.triangles, Uint32Array);
+  const positions = flatArray(mesh.positions, Float32Array);
+  const normals = flatArray(mesh.normals, Float32Array);
+  const curvatureMin = flatArray(mesh.curvature_min, Float32Array);
+  const count = triangles.length;
+  const position = new Float32Array(3 * count);
+  const normal = new Float32Array(3 * count);
+  const curvature = new Float32Array(3 * count);
+  const indexInTriangle = new Float32Array(count);
+  const elements =
+    count <= 65536 ? new Uint16Array(count) : new Uint32Array(count);
+  for (let i = 0; i < count; i++) {
+    const v = 3 * triangles[i];
+    for (let k = 0; k < 3; k++) {
+      position[3 * i + k] = positions[v + k];
+      normal[3 * i + k] = normals[v + k];
+      curvature[3 * i + k] = curvatureMin[v + k];
+    }
+    indexInTriangle[i] = i % 3;
+    elements[i] = i;
   }
   return {
     elements,
@@ -2,7 +2,7 @@ import Regl from "regl";
 import { mat4 } from "gl-matrix";
 import Tweakpane from "tweakpane";
 
-import { loadMesh } from "../common/geometry";
+import { loadMesh, streamMeshLevels } from "../common/geometry";
 import { generatePencilTextures } from "../common/texture";
 import { saveImage, loadImage } from "../common/utils";
 import createCamera from "../common/camera";
@@ -25,7 +25,16 @@ const meshes = {
   Torus: torusUrl,
 };
 
-const regl = Regl({ extensions: ["OES_standard_derivatives"] });
+if (import.meta.env.DEV) {
+  // Computed on demand by scripts/server.py (paths relative to scripts/).
+  meshes["Bunny (service)"] =
+    "/api/curvature?source=model&input=../models/bunny_1k.obj&estimator=taubin&format=binary";
+}
+
+const regl = Regl({
+  extensions: ["OES_standard_derivatives"],
+  optionalExtensions: ["OES_element_index_uint"],
+});
 
 const camera = createCamera(document.getElementsByTagName("canvas")[0], {
   eye: [1.7, 1.5, 2.9],
@@ -47,11 +56,13 @@ function initPane() {
     speed: 0.5,
     angle: 0,
     fps: "---",
+    status: "",
   };
 
   pane.addInput(params, "scale", { min: 0, max: 50 });
   pane.addInput(params, "mesh", { options: meshes }).on("change", updateMesh);
   pane.addMonitor(params, "fps");
+  pane.addMonitor(params, "status");
 
   const textures = pane.addFolder({ title: "Textures" });
   const texParams = {
@@ -99,8 +110,34 @@ function generateTextures(texParams) {
 }
 
 async function updateMesh() {
-  const resp = await fetch(params.mesh);
-  const mesh = await resp.json();
+  const url = params.mesh;
+  params.status = "loading";
+  try {
+    const resp = await fetch(url);
+    if (!resp.ok) {
+      const detail = await resp.text();
+      throw new Error(`${resp.status} ${resp.statusText}: ${detail}`);
+    }
+    if (!url.endsWith(".bin") && !url.includes("format=binary")) {
+      const mesh = await resp.json();
+      if (params.mesh !== url) return;
+      setMesh(mesh.levels ? mesh.levels[mesh.levels.length - 1] : mesh);
+    } else {
+      // Binary assets are drawn level by level, coarse to fine, as they arrive.
+      for await (const level of streamMeshLevels(resp)) {
+        if (params.mesh !== url) return;
+        setMesh(level);
+      }
+    }
+    if (params.mesh === url) params.status = "";
+  } catch (error) {
+    if (params.mesh !== url) return;
+    params.status = error.message;
+    console.error(`Failed to load ${url}:`, error);
+  }
+}
+
+function setMesh(mesh) {
   const data = loadMesh(mesh);
   attributes = data.attributes;
   elements = data.elements;
@@ -137,7 +174,8 @@ const draw = regl({
   },
 });
 
-Promise.all([initTextures(), updateMesh()]).then(() => {
+updateMesh();
+initTextures().then(() => {
   const frameTimes = [...Array(60)].fill(0);
   regl.frame(() => {
     const lastTime = frameTimes.shift();
@@ -147,9 +185,11 @@ Promise.all([initTextures(), updateMesh()]).then(() => {
       params.fps = (1000 / ((time - lastTime) / frameTimes.length)).toFixed(2);
     }
     regl.clear({ color: [1, 1, 1, 1] });
-    draw({
-      eye: camera.eye,
-      center: camera.center,
-    });
+    if (elements) {
+      draw({
+        eye: camera.eye,
+        center: camera.center,
+      });
+    }
   });
 });
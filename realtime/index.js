@@ -38,6 +38,7 @@ const regl = Regl({
     "OES_texture_float_linear",
     "OES_standard_derivatives",
   ],
+  optionalExtensions: ["OES_element_index_uint"],
 });
 
 const camera = createCamera(document.getElementsByTagName("canvas")[0], {
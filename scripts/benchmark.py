@@ -0,0 +1,315 @@
+"""
+Headless benchmark of the curvature estimators.
+
+Runs both compute_curvature_directions_* estimators on procedural meshes
+(Open3D tori and spheres at increasing resolutions, the SDF examples) and on
+the bundled models/*.json assets, and records wall time, vertices per
+second, peak traced memory and, where the surface is known, the error of the
+Gaussian and mean curvature against the analytic values. Results are written
+to a JSON file and compared to a stored baseline; the exit status is 1 if any
+case got slower or less accurate than the baseline allows. Timings are only
+compared when the baseline was recorded in the same environment. With
+--precision float32 each case is also compared to float64, and the tori and
+spheres fail when they exceed PRECISION_BOUNDS, whether or not there is a
+baseline.
+
+    python benchmark.py [--quick] [--cases torus,sphere] [--output FILE]
+                        [--baseline FILE] [--save-baseline]
+
+benchmark_baseline.json was recorded with --quick; CI runs the quick torus
+and SDF cases against it, which checks accuracy only.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import open3d as o3d
+
+import curvature
+import profiling
+from experiments import torus_curvature
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+TORUS_RESOLUTIONS = [(30, 20), (60, 40), (90, 60), (180, 120), (360, 240)]
+SPHERE_RESOLUTIONS = [10, 20, 40, 80, 160]
+SDF_RESOLUTION = 100
+
+ESTIMATORS = {
+    "taubin": curvature.compute_curvature_directions_taubin,
+    "rusinkiewicz": curvature.compute_curvature_directions_rusinkiewicz,
+}
+
+# Largest change of the principal curvatures from float64 to float32, relative
+# to their largest magnitude, on tori and spheres. Taubin's edge curvatures
+# 2 n.e / |e|^2 lose digits as edges get shorter. Marching cubes meshes are not
+# checked: rounding decides which of their right-angled faces are obtuse in
+# curvature.compute_voronoi_area.
+PRECISION_BOUNDS = {
+    "taubin": 1e-3,
+    "rusinkiewicz": 1e-5,
+}
+
+def torus_case(radial, tubular, torus_radius=1.0, tube_radius=0.5):
+    def make():
+        return o3d.geometry.TriangleMesh.create_torus(
+            torus_radius=torus_radius, tube_radius=tube_radius,
+            radial_resolution=radial, tubular_resolution=tubular)
+    analytic = lambda vertices: torus_curvature(vertices, torus_radius, tube_radius)
+    return "torus-{}x{}".format(radial, tubular), make, analytic
+
+def sphere_case(resolution, radius=1.0):
+    def make():
+        return o3d.geometry.TriangleMesh.create_sphere(radius=radius, resolution=resolution)
+    def analytic(vertices):
+        ones = np.ones(vertices.shape[0])
+        return ones / radius**2, ones / radius
+    return "sphere-{}".format(resolution), make, analytic
+
+def sdf_case(example, resolution):
+    def make():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return curvature.center_mesh(curvature.mesh_from_sdf(example, resolution))
+    return "sdf{}-{}".format(example, resolution), make, None
+
+def model_case(filename):
+    def make():
+        with open(filename) as f:
+            data = json.load(f)
+        mesh = o3d.geometry.TriangleMesh()
+        mesh.vertices = o3d.utility.Vector3dVector(np.array(data["positions"], dtype=np.float64))
+        mesh.triangles = o3d.utility.Vector3iVector(np.array(data["triangles"], dtype=np.int32))
+        return mesh
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return "model-" + name, make, None
+
+def benchmark_cases(quick=False):
+    torus = TORUS_RESOLUTIONS[:3] if quick else TORUS_RESOLUTIONS
+    sphere = SPHERE_RESOLUTIONS[:3] if quick else SPHERE_RESOLUTIONS
+    sdf_resolution = SDF_RESOLUTION // 2 if quick else SDF_RESOLUTION
+    cases = [torus_case(*resolution) for resolution in torus]
+    cases += [sphere_case(resolution) for resolution in sphere]
+    cases += [sdf_case(example, sdf_resolution) for example in sorted(curvature.EXAMPLES)]
+    if not quick:
+        cases += [model_case(filename) for filename in sorted(glob.glob(os.path.join(MODEL_DIR, "*.json")))]
+    return cases
+
+def curvature_error(result, analytic):
+    gaussian, mean = analytic
+    errors = {}
+    for name, estimate, exact in (
+        ("gaussian", result.gaussian, gaussian),
+        ("mean", result.mean, mean),
+    ):
+        diff = np.abs(estimate - exact)
+        errors[name + "_rms"] = float(np.sqrt(np.mean(diff**2)))
+        errors[name + "_max"] = float(diff.max())
+    return errors
+
+def precision_error(result, reference):
+    """Largest change of the principal curvatures against a float64 reference, relative to their magnitude."""
+    diff = max(np.abs(result.eig_min - reference.eig_min).max(), np.abs(result.eig_max - reference.eig_max).max())
+    scale = max(np.abs(reference.eig_min).max(), np.abs(reference.eig_max).max())
+    return float(diff / scale)
+
+def measure(estimator, mesh, repeat):
+    """
+    Best wall time of repeat runs, then the peak traced memory and the
+    per-stage profile of one more run, topology construction included
+    (normals are computed once beforehand, see run_benchmark).
+    """
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    wall = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = estimator(mesh, topology=curvature.MeshTopology(vertices, triangles))
+            wall.append(time.perf_counter() - start)
+        with profiling.profile() as profiler, profiling.stage("run"):
+            estimator(mesh, topology=curvature.MeshTopology(vertices, triangles))
+    stages = profiler.report()
+    return min(wall), stages[0]["peak_bytes"], stages[1:], result
+
+def run_benchmark(cases, estimators, repeat=3, dtype=np.float64):
+    results = []
+    for name, make, analytic in cases:
+        full = curvature.Mesh(make())
+        mesh = full.astype(dtype)
+        mesh.normals
+        num_vertices = len(mesh.vertices)
+        for estimator in estimators:
+            wall, peak, stages, curvature_result = measure(ESTIMATORS[estimator], mesh, repeat)
+            result = {
+                "case": name,
+                "estimator": estimator,
+                "precision": np.dtype(dtype).name,
+                "vertices": num_vertices,
+                "triangles": len(mesh.triangles),
+                "wall": wall,
+                "vertices_per_sec": num_vertices / wall,
+                "peak_bytes": peak,
+                "error": None,
+                "precision_error": None,
+                "precision_bound": None,
+                "stages": stages,
+            }
+            if analytic is not None:
+                result["error"] = curvature_error(curvature_result, analytic(np.asarray(mesh.vertices)))
+            if mesh.vertices.dtype != np.float64:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    reference = ESTIMATORS[estimator](full)
+                result["precision_error"] = precision_error(curvature_result, reference)
+                if analytic is not None:
+                    result["precision_bound"] = PRECISION_BOUNDS[estimator]
+            results.append(result)
+            print_result(result)
+    return results
+
+def print_result(result):
+    line = "{:<22} {:<13} {:>9} verts {:>9.4f} s {:>12.0f} verts/s {:>9.1f} MiB".format(
+        result["case"], result["estimator"], result["vertices"], result["wall"],
+        result["vertices_per_sec"], result["peak_bytes"] / 2**20)
+    if result["error"] is not None:
+        line += "  K rms {:.3e}  H rms {:.3e}".format(result["error"]["gaussian_rms"], result["error"]["mean_rms"])
+    if result["precision_error"] is not None:
+        line += "  vs float64 {:.1e}".format(result["precision_error"])
+    print(line, flush=True)
+
+def check_precision(results):
+    """Return the cases whose curvatures drift further from float64 than their precision bound."""
+    regressions = []
+    for result in results:
+        error, bound = result["precision_error"], result["precision_bound"]
+        if bound is not None and error > bound:
+            regressions.append("{} {}: {} differs from float64 by {:.3e} > {:.0e}".format(
+                result["case"], result["estimator"], result["precision"], error, bound))
+    return regressions
+
+def compare(results, baseline, time_tolerance, error_tolerance, timings=True):
+    """Print the change of each case against the baseline and return the regressions."""
+    previous = {(r["case"], r["estimator"], r.get("precision", "float64")): r for r in baseline["results"]}
+    regressions = []
+    print("\n{:<22} {:<13} {:>9} {:>14}".format("case", "estimator", "speedup", "H rms change"))
+    for result in results:
+        base = previous.get((result["case"], result["estimator"], result["precision"]))
+        if base is None:
+            continue
+        speedup = base["wall"] / result["wall"]
+        line = "{:<22} {:<13} {:>8.2f}x".format(result["case"], result["estimator"], speedup)
+        if timings and speedup < 1 / time_tolerance:
+            regressions.append("{} {}: {:.2f}x slower".format(result["case"], result["estimator"], 1 / speedup))
+        if result["error"] is not None and base["error"] is not None:
+            line += " {:>+14.3e}".format(result["error"]["mean_rms"] - base["error"]["mean_rms"])
+            for key, value in result["error"].items():
+                limit = base["error"][key] * (1 + error_tolerance) + 1e-12
+                if value > limit:
+                    regressions.append("{} {}: {} {:.3e} > {:.3e}".format(
+                        result["case"], result["estimator"], key, value, base["error"][key]))
+        print(line)
+    return regressions
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cases",
+        type = str,
+        required = False,
+        help = "comma separated substrings, run only the cases whose name contains one of them"
+    )
+    parser.add_argument(
+        "--estimators",
+        default = "taubin,rusinkiewicz",
+        type = str,
+        help = "comma separated estimators to run"
+    )
+    parser.add_argument(
+        "--precision",
+        default = "float64",
+        choices = ["float64", "float32"],
+        help = "precision of the meshes passed to the estimators, see curvature.Mesh.astype"
+    )
+    parser.add_argument(
+        "--repeat",
+        default = 3,
+        type = int,
+        help = "timed runs per case, the best one is reported"
+    )
+    parser.add_argument('--quick', dest='quick', action='store_true',
+        help = "only the small procedural meshes")
+    parser.set_defaults(quick=False)
+    parser.add_argument(
+        "--output",
+        default = "benchmark_results.json",
+        type = str,
+        help = "results file"
+    )
+    parser.add_argument(
+        "--baseline",
+        default = BASELINE,
+        type = str,
+        help = "baseline results to compare against, if the file exists"
+    )
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true',
+        help = "also write the results as the new baseline")
+    parser.set_defaults(save_baseline=False)
+    parser.add_argument(
+        "--time-tolerance",
+        default = 1.25,
+        type = float,
+        help = "a case regresses when it is this many times slower than the baseline"
+    )
+    parser.add_argument(
+        "--error-tolerance",
+        default = 0.01,
+        type = float,
+        help = "a case regresses when an error grows by more than this fraction"
+    )
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    cases = benchmark_cases(args.quick)
+    if args.cases is not None:
+        patterns = args.cases.split(",")
+        cases = [case for case in cases if any(p in case[0] for p in patterns)]
+    results = run_benchmark(cases, args.estimators.split(","), args.repeat, np.dtype(args.precision))
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    regressions = check_precision(results)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    elif not os.path.exists(args.baseline):
+        print("\nno baseline at {}, run with --save-baseline to store one".format(args.baseline))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        timings = baseline["environment"] == report["environment"]
+        if not timings:
+            print("\nbaseline was recorded in a different environment, comparing accuracy only")
+        regressions += compare(results, baseline, args.time_tolerance, args.error_tolerance, timings)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+"""
+Build the curvature assets listed in a manifest on a process pool.
+
+Each job in the manifest is a dict of curvature.py command line options
+(source, input, example, resolution, taubin, simplify, target_num, output,
+...), with paths relative to the manifest. Jobs whose input and scene files,
+parameters and scripts (curvature.py and the local modules it imports) are
+unchanged since their last successful build are skipped.
+
+    python build.py assets.json [--jobs N] [--force] [--profile FILE]
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import curvature
+import profiling
+from cache import file_digest
+
+STATE_FILE = ".build_state.json"
+PATH_OPTIONS = ("input", "scene", "output", "tiles", "cache")
+INPUT_OPTIONS = ("input", "scene")
+NEGATABLE_OPTIONS = ("simplify", "vis")
+
+def job_argv(job):
+    argv = []
+    for key, value in job.items():
+        if value is True:
+            argv.append("--" + key)
+        elif value is False:
+            if key in NEGATABLE_OPTIONS:
+                argv.append("--no-" + key)
+        else:
+            argv += ["--" + key, str(value)]
+    return argv
+
+def resolve_paths(job, base_dir):
+    job = dict(job)
+    for key in PATH_OPTIONS:
+        if key in job:
+            job[key] = os.path.normpath(os.path.join(base_dir, job[key]))
+    return job
+
+def script_files():
+    """curvature.py and the modules of this directory it imports, directly or not."""
+    script_dir = os.path.dirname(os.path.abspath(curvature.__file__))
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path is None or os.path.abspath(path) == os.path.abspath(__file__):
+            continue
+        if os.path.dirname(os.path.abspath(path)) == script_dir:
+            files.add(os.path.abspath(path))
+    return sorted(files)
+
+def job_key(job):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(job, sort_keys=True).encode())
+    for path in script_files():
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    for key in INPUT_OPTIONS:
+        if os.path.exists(job.get(key, "")):
+            digest.update(file_digest(job[key]).encode())
+    return digest.hexdigest()
+
+def reset_peak_rss():
+    """Reset the RSS high-water mark of this process; False where that is unsupported (not Linux)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """RSS high-water mark of this process in KiB, since the last reset_peak_rss."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+def run_job(job, profile=False):
+    # pool workers are reused, so the peak is reset for every job
+    measured = reset_peak_rss()
+    start = time.perf_counter()
+    with profiling.profile() if profile else contextlib.nullcontext() as profiler:
+        curvature.run(curvature.build_parser().parse_args(job_argv(job)))
+    wall = time.perf_counter() - start
+    return wall, peak_rss() if measured else None, profiler.report() if profiler is not None else None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", type=str, help="JSON list of jobs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="rebuild jobs even if they are up to date")
+    parser.add_argument("--profile", type=str, help="write the per-stage profile of each built job to this JSON file")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    with open(args.manifest) as f:
+        jobs = [resolve_paths(job, base_dir) for job in json.load(f)]
+
+    state_path = os.path.join(base_dir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    # state is keyed by output path relative to the manifest
+    pending = {}
+    for job in jobs:
+        name = os.path.relpath(job["output"], base_dir)
+        key = job_key(job)
+        if not args.force and state.get(name) == key and os.path.exists(job["output"]):
+            print("{:<40} up to date".format(name))
+            continue
+        pending[name] = (job, key)
+
+    failures = 0
+    profiles = {}
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(pending)))) as pool:
+            futures = {pool.submit(run_job, job, args.profile is not None): name for name, (job, _) in pending.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    wall, peak_rss, profiles[name] = future.result()
+                except Exception as e:
+                    failures += 1
+                    state.pop(name, None)
+                    print("{:<40} FAILED: {!r}".format(name, e))
+                    continue
+                state[name] = pending[name][1]
+                peak = "{:10.1f} MiB peak RSS".format(peak_rss / 1024) if peak_rss is not None else "peak RSS unavailable"
+                print("{:<40} {:8.2f} s {}".format(name, wall, peak))
+                with open(state_path, "w") as f:
+                    json.dump(state, f, indent=2)
+
+    if args.profile is not None:
+        with open(args.profile, "w") as f:
+            json.dump(profiles, f, indent=2)
+    print("{} built, {} failed, {} up to date".format(len(pending) - failures, failures, len(jobs) - len(pending)))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
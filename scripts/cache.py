@@ -0,0 +1,107 @@
+"""
+On-disk content-addressed cache for intermediate pipeline stages.
+
+Each entry is a directory of .npy files named by a hash of the stage
+parameters (which include the digest of the input file's bytes, so edits to
+an input invalidate everything derived from it). Entries are loaded
+memory-mapped, and the least recently used ones are evicted once the cache
+grows past max_bytes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+def file_digest(path):
+    """sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class PipelineCache:
+    def __init__(self, root, max_bytes=2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._digests_path = os.path.join(root, "digests.json")
+        # shared by processes using the same root: replaced atomically, and
+        # only a hint, so an unreadable file counts as empty
+        self._digests = {}
+        try:
+            with open(self._digests_path) as f:
+                self._digests = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def file_digest(self, path):
+        """sha256 of a file's bytes, remembered while its size and mtime are unchanged."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        known = self._digests.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        digest = file_digest(path)
+        self._digests[path] = [stamp, digest]
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._digests, f)
+        os.replace(tmp, self._digests_path)
+        return digest
+
+    def key(self, stage, **params):
+        data = json.dumps([stage, params], sort_keys=True)
+        return stage + "-" + hashlib.sha256(data.encode()).hexdigest()[:32]
+
+    def load(self, key):
+        """Return the arrays stored under key, memory-mapped, or None."""
+        entry = os.path.join(self.root, key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            os.utime(entry)
+            arrays = {}
+            for name in sorted(os.listdir(entry)):
+                if name.endswith(".npy"):
+                    arrays[name[:-4]] = np.load(os.path.join(entry, name), mmap_mode="r")
+        except FileNotFoundError:
+            # evicted by another process meanwhile
+            return None
+        return arrays
+
+    def store(self, key, arrays):
+        entry = os.path.join(self.root, key)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), np.asarray(array))
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        for key in os.listdir(self.root):
+            entry = os.path.join(self.root, key)
+            if not os.path.isdir(entry) or key.startswith("."):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                mtime = os.path.getmtime(entry)
+            except FileNotFoundError:
+                # evicted or replaced by another process meanwhile
+                continue
+            entries.append((mtime, key, size))
+            total += size
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
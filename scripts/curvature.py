@@ -1,292 +1,956 @@
 import open3d as o3d
 import numpy as np
-from scipy.linalg import eig
-from scipy.spatial.transform import Rotation
 import mcubes #pip install --upgrade PyMCubes
+import os
 import json
 import argparse
+import contextlib
+import itertools
+import weakref
+import zlib
+from functools import cached_property
 from matplotlib import cm
+from scipy.sparse import csr_matrix, diags #pip install scipy
 
-# -- Begin primitive SDFs from
-# https://iquilezles.org/www/articles/distfunctions/distfunctions.htm
+from cache import PipelineCache
+from decimate import decimate, fidelity
+from geometry import normalize, compute_tangent_frames, principal_curvatures_2x2, principal_directions
+from export import acmr, reorder_mesh, encode_octahedral, encode_fixed
+from pointcloud import pointcloud_curvature
+from profiling import profile, stage
+from sdf import EXAMPLES, load_scene, compile_scene, sdf_grid_tiled, sdf_grid_adaptive
+from sdf import grid_to_scene, scene_to_grid, sdf_derivatives, snap_to_surface
 
+_example_plans = {}
 
-def length(p):
-    return np.linalg.norm(p, axis=-1)
+def sdf_map(pos, example):
+    if example not in _example_plans:
+        _example_plans[example] = compile_scene(load_scene(EXAMPLES[example]))
+    return _example_plans[example](pos)
 
-def mix(x, y, a):
-    return (1-a)*x + a*y
+def mesh_from_sdf(example, n=40, adaptive=False, dtype=np.float64, threads=None, scene=None):
+    if scene is None:
+        scene = load_scene(EXAMPLES[example])
+    sdf = compile_scene(scene)
+    with stage("sdf_grid", points=n**3):
+        if adaptive:
+            sdf_grid = sdf_grid_adaptive(sdf, n, dtype=dtype)
+        else:
+            sdf_grid = sdf_grid_tiled(sdf, n, dtype=dtype, threads=threads)
+    with stage("marching_cubes", points=n**3) as record:
+        vertices, triangles = mcubes.marching_cubes(sdf_grid, 0)
+        record.update(vertices=len(vertices), faces=len(triangles))
+    print(vertices.shape, triangles.shape)
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(vertices)
+    mesh.triangles = o3d.utility.Vector3iVector(triangles[:,::-1])
+    return mesh
 
-def sdSphere(p, s):
-    return length(p) - s
+def dot(a, b):
+    return np.einsum("...i,...i->...", a, b)
 
-def sdBox(p, b):
-    q = np.abs(p) - b
-    return length(np.maximum(q, 0)) + np.minimum(np.amax(q, axis=-1), 0)
+def compute_face_areas(vertices, triangles):
+    a, b, c = vertices[triangles[:,0]], vertices[triangles[:,1]], vertices[triangles[:,2]]
+    return 0.5 * np.linalg.norm(np.cross(a-b, a-c), axis=-1)
 
-def sdCylinder(p, c):
-    return length(np.take(p, [0,2], -1) -np.take(c, [0,1], -1)) - c[...,2]
+def compute_voronoi_area(a, b, c):
+    cross = np.linalg.norm(np.cross(a-b, a-c), axis=-1)
+    area = 0.5 * cross
+    dot_a, dot_b, dot_c = dot(a-b, a-c), dot(b-c, b-a), dot(c-a, c-b)
+    uniform = (area < 1e-8) | (dot_a < 0) | (dot_b < 0) | (dot_c < 0)
+    cross = np.where(uniform, 1, cross)
+    ta = dot(b-c, b-c)/4 * dot_a/cross
+    tb = dot(c-a, c-a)/4 * dot_b/cross
+    tc = dot(a-b, a-b)/4 * dot_c/cross
+    voronoi = np.stack([(tb+tc)/2, (tc+ta)/2, (ta+tb)/2], axis=-1)
+    return np.where(uniform[...,None], area[...,None]/3, voronoi)
 
-def sdTorus(p, t):
-    q = np.concatenate([length(np.take(p, [0,2], -1))[...,None]-t[...,0],p[...,1][...,None]], axis=-1)
-    return length(q)-t[...,1]
+class MeshTopology:
+    """
+    Adjacency of a triangle mesh in CSR form, corner c being slot c % 3 of
+    face c // 3, plus the face and corner areas used by the estimators.
+    """
 
-# End primitive SDFs --
+    def __init__(self, vertices, triangles):
+        vertices = np.asarray(vertices)
+        self.triangles = np.ascontiguousarray(triangles, dtype=np.int32)
+        self.num_vertices = n = vertices.shape[0]
+        self.num_faces = self.triangles.shape[0]
 
-def opSmoothUnion(d1, d2, k):
-    h = np.clip( 0.5 + 0.5*(d2-d1)/k, 0.0, 1.0 )
-    return mix( d2, d1, h) - k*h*(1-h)
+        corner_vertices = self.triangles.ravel()
+        self.corner_offsets = self._offsets(corner_vertices)
+        self.corner_indices = np.argsort(corner_vertices, kind="stable").astype(np.int32)
 
-def sdf_map(pos, example):
-    if example == 1:
-        torus = sdTorus(pos, np.array([1.0, 0.15]))
-        sphere = sdSphere(pos - np.array([1.0, 0.0, 0.0]), 0.2)
-        return opSmoothUnion(torus, sphere, 0.4)
-    elif example == 2:
-        base = np.maximum(sdSphere(pos, 1.0), sdBox(pos, np.array([0.75]*3)))
-        cyl1 = sdCylinder(np.take(pos,[0,1,2], -1), np.array([0.0, 0.0, 0.5]))
-        cyl2 = sdCylinder(np.take(pos,[1,2,0], -1), np.array([0.0, 0.0, 0.5]))
-        cyl3 = sdCylinder(np.take(pos,[2,0,1], -1), np.array([0.0, 0.0, 0.5]))
-        return np.maximum(-np.amin([cyl1, cyl2, cyl3], axis=0), base)
-
-def mesh_from_sdf(example, n=40):
-    x = np.linspace(-2, 2, n)
-    y = np.linspace(-2, 2, n)
-    z = np.linspace(-2, 2, n)
-    coord_grid = np.concatenate([coord[...,None] for coord in np.meshgrid(x, y, z, sparse=False)], axis=-1)
-    sdf_grid = sdf_map(coord_grid, example)
-    vertices, triangles = mcubes.marching_cubes(sdf_grid, 0)
-    print(vertices.shape, triangles.shape)
-    mesh = o3d.geometry.TriangleMesh()
-    mesh.vertices = o3d.utility.Vector3dVector(vertices)
-    mesh.triangles = o3d.utility.Vector3iVector(triangles[:,::-1])
-    return mesh
+        src = self.triangles[:, [0, 0, 1, 1, 2, 2]].ravel().astype(np.int64)
+        dst = self.triangles[:, [1, 2, 2, 0, 0, 1]].ravel()
+        pairs = np.unique(src * n + dst)
+        self.neighbor_offsets = self._offsets(pairs // n)
+        self.neighbor_indices = (pairs % n).astype(np.int32)
 
-def compute_curvature_directions_taubin(mesh):
-    mesh.compute_vertex_normals()
+        self.update_areas(vertices)
+        self.fingerprint = mesh_fingerprint(vertices, self.triangles)
 
-    vertices = np.array(mesh.vertices)
-    triangles = np.array(mesh.triangles)
+    def _offsets(self, keys):
+        offsets = np.zeros(self.num_vertices + 1, dtype=np.int32)
+        np.cumsum(np.bincount(keys, minlength=self.num_vertices), out=offsets[1:])
+        return offsets
 
-    n = vertices.shape[0]
-    m = triangles.shape[0]
+    def update_areas(self, vertices):
+        t = self.triangles
+        self.face_areas = compute_face_areas(vertices, t)
+        self.corner_areas = compute_voronoi_area(vertices[t[:,0]], vertices[t[:,1]], vertices[t[:,2]])
+
+    def incident_corners(self, i):
+        return self.corner_indices[self.corner_offsets[i]:self.corner_offsets[i+1]]
+
+    def neighbors(self, i):
+        return self.neighbor_indices[self.neighbor_offsets[i]:self.neighbor_offsets[i+1]]
+
+    def _gather(self, offsets, indices, rows):
+        """Concatenated CSR runs of the given rows, and the start of each run in the result."""
+        begin, end = offsets[rows], offsets[np.asarray(rows) + 1]
+        counts = end - begin
+        starts = np.zeros(len(counts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        positions = np.arange(counts.sum()) + np.repeat(begin - starts, counts)
+        return indices[positions], starts
+
+    def incident_faces(self, rows):
+        """Sorted faces incident to any of the given vertices."""
+        corners, _ = self.corner_runs(rows)
+        return np.unique(corners // 3)
+
+    def corner_runs(self, rows):
+        """Concatenated incident corners of the given vertices, and the start of each vertex's run."""
+        return self._gather(self.corner_offsets, self.corner_indices, rows)
+
+    def one_ring(self, rows):
+        """Sorted union of the given vertices and their neighbors."""
+        neighbors, _ = self._gather(self.neighbor_offsets, self.neighbor_indices, rows)
+        return np.union1d(rows, neighbors)
+
+    def vertex_sum(self, corner_values, rows=None):
+        """
+        Sum per-corner values (leading dimension 3 * num_faces) onto vertices,
+        or onto the given vertices only.
+        """
+        values = np.asarray(corner_values)
+        if rows is None:
+            corners, starts = self.corner_indices, self.corner_offsets[:-1]
+            counts = np.diff(self.corner_offsets)
+        else:
+            corners, starts = self.corner_runs(rows)
+            counts = np.diff(self.corner_offsets)[rows]
+        out = np.zeros((len(starts),) + values.shape[1:], dtype=values.dtype)
+        nonempty = counts > 0
+        if corners.size > 0:
+            out[nonempty] = np.add.reduceat(values[corners], starts[nonempty], axis=0)
+        return out
+
+def readonly(array):
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+class Mesh:
+    """
+    Triangle mesh with cached arrays, normals and topology, wrapping an Open3D
+    TriangleMesh or plain arrays. Call invalidate() after editing the Open3D mesh.
+    """
+
+    def __init__(self, mesh):
+        self._o3d = mesh
+        self._vertices = self._triangles = None
+        self.invalidate()
+
+    @classmethod
+    def from_arrays(cls, vertices, triangles, normals=None, dtype=np.float64):
+        mesh = cls(None)
+        mesh._vertices = readonly(np.asarray(vertices, dtype=dtype))
+        mesh._triangles = readonly(np.asarray(triangles, dtype=np.int32))
+        if normals is not None:
+            mesh._normals = readonly(np.asarray(normals, dtype=dtype))
+        return mesh
+
+    def astype(self, dtype):
+        """
+        Copy with vertices and normals in dtype, normals computed in float64 first.
+        benchmark.py --precision float32 checks the accuracy of float32.
+        """
+        return Mesh.from_arrays(self.vertices, self.triangles, self.normals, dtype=dtype)
+
+    def invalidate(self):
+        """Drop the cached arrays, normals and topology."""
+        if self._o3d is not None:
+            self._vertices = self._triangles = None
+        self._normals = None
+        self._topology = None
+
+    @property
+    def o3d(self):
+        if self._o3d is None:
+            mesh = o3d.geometry.TriangleMesh()
+            mesh.vertices = o3d.utility.Vector3dVector(self._vertices.astype(np.float64))
+            mesh.triangles = o3d.utility.Vector3iVector(self._triangles)
+            if self._normals is not None:
+                mesh.vertex_normals = o3d.utility.Vector3dVector(self._normals.astype(np.float64))
+            self._o3d = mesh
+        return self._o3d
+
+    @property
+    def vertices(self):
+        if self._vertices is None:
+            self._vertices = readonly(self._o3d.vertices)
+        return self._vertices
 
-    normals = np.array(mesh.vertex_normals)
-    areas = np.zeros((m), dtype=float)
-    matrices = np.zeros((n, 3, 3), dtype=float)
-    curvature_max = np.zeros((n, 3), dtype=float)
-    curvature_min = np.zeros((n, 3), dtype=float)
+    @property
+    def triangles(self):
+        if self._triangles is None:
+            self._triangles = readonly(self._o3d.triangles)
+        return self._triangles
+
+    @property
+    def normals(self):
+        if self._normals is None:
+            with stage("normals", vertices=len(self.vertices)):
+                if self._o3d is not None:
+                    self._o3d.compute_vertex_normals()
+                    self._normals = readonly(self._o3d.vertex_normals)
+                else:
+                    self._normals = readonly(compute_vertex_normals(self.vertices, self.triangles))
+        return self._normals
+
+    @property
+    def topology(self):
+        if self._topology is None:
+            if self._o3d is not None:
+                self._topology = get_topology(self._o3d)
+            else:
+                with stage("topology", vertices=len(self.vertices), faces=len(self.triangles)):
+                    self._topology = MeshTopology(self.vertices, self.triangles)
+        return self._topology
+
+    def set_vertices(self, vertices):
+        if self._o3d is not None:
+            self._o3d.vertices = o3d.utility.Vector3dVector(vertices)
+        else:
+            self._vertices = readonly(np.array(vertices, dtype=self._vertices.dtype))
+        self.invalidate()
+
+def as_mesh(mesh):
+    """Return mesh as a Mesh, wrapping an Open3D TriangleMesh."""
+    return mesh if isinstance(mesh, Mesh) else Mesh(mesh)
+
+def mesh_fingerprint(vertices, triangles):
+    vertices = np.ascontiguousarray(vertices)
+    triangles = np.ascontiguousarray(triangles)
+    return (vertices.shape, triangles.shape, zlib.crc32(vertices), zlib.crc32(triangles))
+
+_topology_cache = weakref.WeakKeyDictionary()
+
+def get_topology(mesh):
+    """
+    Return the MeshTopology of a Mesh, or of an Open3D mesh, reusing it while
+    the geometry is unchanged.
+    """
+    if isinstance(mesh, Mesh):
+        return mesh.topology
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+    topology = _topology_cache.get(mesh)
+    if topology is None or topology.fingerprint != mesh_fingerprint(vertices, triangles):
+        with stage("topology", vertices=len(vertices), faces=len(triangles)):
+            topology = MeshTopology(vertices, triangles)
+        _topology_cache[mesh] = topology
+    return topology
+
+class CurvatureResult:
+    """
+    Principal directions (n, 3) and curvatures (n,), with the derived fields
+    computed on first access. Unpacks like the 5-tuple the estimators returned.
+    """
+
+    FIELDS = ("curvature_min", "curvature_max", "eig_min", "eig_max", "confidence")
+
+    def __init__(self, curvature_min, curvature_max, eig_min, eig_max, confidence=None):
+        self.curvature_min = curvature_min
+        self.curvature_max = curvature_max
+        self.eig_min = eig_min
+        self.eig_max = eig_max
+        if confidence is not None:
+            self.confidence = confidence
+
+    def __iter__(self):
+        return iter([getattr(self, name) for name in self.FIELDS])
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __getitem__(self, i):
+        return tuple(self)[i]
+
+    @cached_property
+    def gaussian(self):
+        return self.eig_min * self.eig_max
+
+    @cached_property
+    def mean(self):
+        return 0.5 * (self.eig_min + self.eig_max)
+
+    @cached_property
+    def shape_index(self):
+        return 2 / np.pi * np.arctan2(self.eig_max + self.eig_min, self.eig_max - self.eig_min)
+
+    @cached_property
+    def confidence(self):
+        spread = np.abs(self.eig_max - self.eig_min)
+        scale = np.abs(self.eig_max) + np.abs(self.eig_min)
+        return np.divide(spread, scale, out=np.zeros_like(spread), where=scale > 0)
+
+def compute_curvature_directions_taubin(mesh, topology=None):
+    mesh = as_mesh(mesh)
+    with stage("taubin", vertices=len(mesh.vertices), faces=len(mesh.triangles)):
+        normals = mesh.normals
+        if topology is None:
+            topology = get_topology(mesh)
+        return taubin_curvature(mesh.vertices, normals, topology)
+
+def taubin_curvature(vertices, normals, topology):
+    with stage("tensors", edges=6 * topology.num_faces):
+        corner_terms = taubin_corner_terms(vertices, normals, topology.triangles, topology.face_areas)
+        sums = topology.vertex_sum(corner_terms)
+    has_edges = np.diff(topology.corner_offsets) > 0
+    with stage("eigensolve", vertices=topology.num_vertices):
+        return CurvatureResult(*taubin_principal_curvatures(sums, normals, has_edges))
+
+def taubin_corner_terms(vertices, normals, triangles, face_areas):
+    """
+    Per-corner terms (3 * len(triangles), 7) of the Taubin estimator: the upper
+    triangle of the corner's tensor, and its area.
+    """
+    eps = 1e-8
+
+    # each corner contributes the edges to the two other corners of its
+    # triangle, weighted by the area of that triangle
+    src = triangles[:, [0, 0, 1, 1, 2, 2]].ravel()
+    dst = triangles[:, [1, 2, 2, 0, 0, 1]].ravel()
+    edge_areas = np.repeat(face_areas, 6)
+
+    nv = -normals[src]
+    uv = vertices[dst] - vertices[src]
+    uv_sq = dot(uv, uv)
+    innuv = uv - dot(nv, uv)[:,None] * nv
+    innuv_len = np.linalg.norm(innuv, axis=-1)
+
+    # degenerate edges, and edges parallel to the normal (which have no
+    # tangent direction), are given zero weight instead of being filtered out
+    valid = (edge_areas >= eps) & (np.sqrt(uv_sq) >= eps) & (innuv_len >= eps)
+    edge_areas = np.where(valid, edge_areas, 0)
+    uv_sq[~valid] = 1
+    innuv_len[~valid] = 1
+
+    t = innuv / innuv_len[:,None]
+    kappa = 2 * dot(nv, uv) / uv_sq
+    weights = edge_areas * kappa
+
+    edge_terms = np.empty((7, src.shape[0]), dtype=vertices.dtype)
+    k = 0
+    for j in range(3):
+        for l in range(j, 3):
+            np.multiply(weights * t[:,j], t[:,l], out=edge_terms[k])
+            k += 1
+    edge_terms[6] = edge_areas
+    return (edge_terms[:,0::2] + edge_terms[:,1::2]).T
+
+def taubin_principal_curvatures(sums, normals, has_edges):
+    """
+    Principal directions and curvatures from per-vertex sums of
+    taubin_corner_terms, in the dtype of the sums. The eigensolve itself
+    always runs in float64.
+    """
+    n = sums.shape[0]
+
+    curvature_max = np.zeros((n, 3), dtype=sums.dtype)
+    curvature_min = np.zeros((n, 3), dtype=sums.dtype)
     curvature_max[:,0] = 1
     curvature_min[:,0] = 1
-    eig_max = np.zeros((n,), dtype=float)
-    eig_min = np.zeros((n,), dtype=float)
-    confidence = np.zeros((n,), dtype=float)
+    eig_max = np.zeros((n,), dtype=sums.dtype)
+    eig_min = np.zeros((n,), dtype=sums.dtype)
 
-    eps = 1e-8
-    edges = [[] for i in range(n)]
-
-    for i in range(m):
-        a, b, c = vertices[triangles[i,0]], vertices[triangles[i,1]], vertices[triangles[i,2]]
-        areas[i] = 0.5 * np.linalg.norm(np.cross(a-b, a-c))
-        for ja in range(3):
-            jb = (ja+1)%3
-            jc = (ja+2)%3
-            edges[triangles[i,ja]].append((triangles[i,jb], i))
-            edges[triangles[i,ja]].append((triangles[i,jc], i))
-
-    for i in range(n):
-        total_area = 0
-        nv = -normals[i][:,None]
-        inn = np.identity(3) - nv @ nv.T
-        if len(edges[i]) == 0:
-            continue
-        for u, tri in edges[i]:
-            uv = (vertices[u] - vertices[i])[:,None]
-            if areas[tri] < eps or np.linalg.norm(uv) < eps:
-                #print(areas[tri], np.inner(uv[:,0], uv[:,0]))
-                continue
-            innuv = inn @ uv
-            fail_count = 0
-            while np.linalg.norm(innuv) < eps and fail_count < 10:
-                uv += np.random.normal(0, 0.01 * np.linalg.norm(uv), uv.shape)
-                innuv = inn @ uv
-                fail_count += 1
-            if fail_count >= 10:
-                continue
+    matrices = np.empty((n, 3, 3), dtype=np.float64)
+    k = 0
+    for j in range(3):
+        for l in range(j, 3):
+            matrices[:,j,l] = matrices[:,l,j] = sums[:,k]
+            k += 1
+    total_area = sums[:,6]
 
-            t = innuv / np.linalg.norm(innuv)
-            kappa = 2 * np.inner(nv[:,0], uv[:,0]) / np.inner(uv[:,0], uv[:,0])
+    #not necessary for finding eigenvectors
+    has_area = total_area > 0
+    matrices[has_area] /= total_area[has_area,None,None]
 
-            total_area += areas[tri]
-            matrices[i,:,:] += areas[tri] * kappa * (t @ t.T)
+    eigvals, eigvecs = np.linalg.eigh(matrices)
+    eigsum = np.sum(eigvals, axis=-1)
+    test_normal = np.einsum("nij,ni->nj", eigvecs, normals)
+    is_normal = np.abs(test_normal ** 2 - 1) < 1e-1
+    for j in range(3):
+        tangent = has_edges & ~is_normal[:,j]
+        is_min = tangent & (2 * eigvals[:,j] < eigsum)
+        is_max = tangent & ~is_min
+        curvature_min[is_min] = eigvecs[is_min,:,j]
+        eig_min[is_min] = 4 * eigvals[is_min,j] - eigsum[is_min]
+        curvature_max[is_max] = eigvecs[is_max,:,j]
+        eig_max[is_max] = 4 * eigvals[is_max,j] - eigsum[is_max]
 
-        #not necessary for finding eigenvectors
-        if total_area > 0:
-            matrices[i,:,:] /= total_area
+    cnt = np.sum(is_normal, axis=-1)
+    bad = np.flatnonzero(has_edges & (cnt != 1))
+    if bad.size > 0:
+        #only occurs when matrix is all zero
+        print("???", bad.size, "vertices without a unique normal eigenvector")
 
-        #print(i)
-        #print(matrices[i,:,:])
+    return curvature_min, curvature_max, eig_min, eig_max
 
-        eigvals, eigvecs = eig(matrices[i])
-        eigvals = eigvals.real
-        eigvecs = eigvecs.real
-        cnt = 0
-        for j in range(3):
-            test_normal = np.dot(eigvecs[:,j], normals[i])
-            if abs(test_normal ** 2 - 1) < 1e-1:
-                cnt += 1
-                continue
-            if 2 * eigvals[j] < np.sum(eigvals):
-                curvature_min[i,:] = eigvecs[:,j]
-                eig_min[i] = 4 * eigvals[j] - np.sum(eigvals)
-            else:
-                curvature_max[i,:] = eigvecs[:,j]
-                eig_max[i] = 4 * eigvals[j] - np.sum(eigvals)
-        #assert cnt == 1, "Eigenvector equal to normal not found"
-        if cnt != 1:
-            #only occurs when matrix is all zero
-            print("???", i, cnt)
-            #print(matrices[i])
-
-    return curvature_min, curvature_max, eig_min, eig_max, confidence
-
-def rand_vec(shape):
-    p = np.random.normal(0, 1.0, shape)
-    return p / np.linalg.norm(p)
-
-def normalize(p):
-    lenp = np.linalg.norm(p)
-    if lenp < 1e-8:
-        return rand_vec(p.shape)
-    return p / lenp
+def rotate_coordinate_system(u, old_normal, new_normal):
+    # rotate u (perpendicular to old_normal) by the smallest rotation taking
+    # old_normal to new_normal, in closed form
+    ndot = dot(old_normal, new_normal)[...,None]
+    flip = ndot <= -1 + 1e-8
+    perp_old = new_normal - ndot * old_normal
+    dperp = (old_normal + new_normal) / np.where(flip, 1, 1 + ndot)
+    return np.where(flip, -u, u - dperp * dot(u, perp_old)[...,None])
 
-def compute_voronoi_area(a, b, c):
-    area = 0.5 * np.linalg.norm(np.cross(a-b, a-c))
-    if area < 1e-8:
-        return [area/3, area/3, area/3]
-    if np.dot(a-b, a-c) < 0 or np.dot(b-c, b-a) < 0 or np.dot(c-a, c-b) < 0:
-        return [area/3, area/3, area/3]
-    ta = (np.linalg.norm(b-c)/2)**2 * np.dot(a-b, a-c)/np.linalg.norm(np.cross(a-b, a-c))
-    tb = (np.linalg.norm(c-a)/2)**2 * np.dot(b-c, b-a)/np.linalg.norm(np.cross(b-c, b-a))
-    tc = (np.linalg.norm(a-b)/2)**2 * np.dot(c-a, c-b)/np.linalg.norm(np.cross(c-a, c-b))
-    return [(tb+tc)/2, (tc+ta)/2, (ta+tb)/2]
-
-def compute_curvature_directions_rusinkiewicz(mesh):
-    mesh.compute_vertex_normals()
-
-    vertices = np.array(mesh.vertices)
-    triangles = np.array(mesh.triangles)
+def compute_curvature_directions_rusinkiewicz(mesh, topology=None):
+    mesh = as_mesh(mesh)
+    with stage("rusinkiewicz", vertices=len(mesh.vertices), faces=len(mesh.triangles)):
+        normals = mesh.normals
+        if topology is None:
+            topology = get_topology(mesh)
+        return rusinkiewicz_curvature(mesh.vertices, normals, topology)
+
+def rusinkiewicz_curvature(vertices, normals, topology):
+    coordinates = compute_tangent_frames(normals)
+    with stage("tensors", corners=3 * topology.num_faces):
+        corner_terms = rusinkiewicz_corner_terms(vertices, normals, coordinates, topology.triangles, topology.corner_areas)
+        sums = topology.vertex_sum(corner_terms.reshape(-1, 4))
+    with stage("eigensolve", vertices=topology.num_vertices):
+        return CurvatureResult(*rusinkiewicz_principal_curvatures(sums, coordinates))
+
+def rusinkiewicz_corner_terms(vertices, normals, coordinates, triangles, corner_areas):
+    """
+    Per-corner terms (len(triangles), 3, 4) of the Rusinkiewicz estimator: the
+    face's [L, M, N] in the frame of the corner's vertex times its area, and the area.
+    """
+    m = triangles.shape[0]
+
+    a, b, c = vertices[triangles[:,0]], vertices[triangles[:,1]], vertices[triangles[:,2]]
+    na, nb, nc = normals[triangles[:,0]], normals[triangles[:,1]], normals[triangles[:,2]]
+    areas = np.where(corner_areas < 1e-8, 0, corner_areas)
+
+    # per-face frame: ax along the first edge, ay the face normal
+    ax = normalize(b - a)
+    ay = normalize(np.cross(b - a, c - a))
+    az = normalize(np.cross(ax, ay))
+
+    # least squares fit of the second fundamental form to the change of normal
+    # along each edge, solved for all faces at once via the normal equations
+    # (accumulated and solved in float64, as they square the condition number)
+    ata = np.zeros((m, 3, 3), dtype=np.float64)
+    atb = np.zeros((m, 3), dtype=np.float64)
+    for e, dn in ((c - b, nc - nb), (c - a, nc - na), (b - a, nb - na)):
+        e0, e1 = dot(e, ax), dot(e, az)
+        d0, d1 = dot(dn, ax), dot(dn, az)
+        ata[:,0,0] += e0 * e0
+        ata[:,0,1] += e0 * e1
+        ata[:,1,1] += e0 * e0 + e1 * e1
+        ata[:,1,2] += e0 * e1
+        ata[:,2,2] += e1 * e1
+        atb[:,0] += e0 * d0
+        atb[:,1] += e1 * d0 + e0 * d1
+        atb[:,2] += e1 * d1
+    ata[:,1,0] = ata[:,0,1]
+    ata[:,2,1] = ata[:,1,2]
+
+    solvable = np.any(areas > 0, axis=-1)
+    solvable &= np.linalg.det(ata) > 1e-12 * np.trace(ata, axis1=1, axis2=2) ** 3
+    x = np.zeros((m, 3), dtype=np.float64)
+    x[solvable] = np.linalg.solve(ata[solvable], atb[solvable][...,None])[...,0]
+    areas[~solvable] = 0
+
+    # rotate the face frame onto each corner's vertex frame and express the
+    # second fundamental form there
+    corner_terms = np.empty((m, 3, 4), dtype=vertices.dtype)
+    for ja in range(3):
+        idx = triangles[:,ja]
+        tax, tay, taz = coordinates[idx,0], coordinates[idx,1], coordinates[idx,2]
+        rax = rotate_coordinate_system(ax, ay, tay)
+        raz = rotate_coordinate_system(az, ay, tay)
+        u0, u1 = dot(tax, rax), dot(tax, raz)
+        w0, w1 = dot(taz, rax), dot(taz, raz)
+        corner_terms[:,ja,0] = x[:,0] * u0 * u0 + 2 * x[:,1] * u0 * u1 + x[:,2] * u1 * u1
+        corner_terms[:,ja,1] = x[:,0] * u0 * w0 + x[:,1] * (u0 * w1 + u1 * w0) + x[:,2] * u1 * w1
+        corner_terms[:,ja,2] = x[:,0] * w0 * w0 + 2 * x[:,1] * w0 * w1 + x[:,2] * w1 * w1
+    corner_terms[...,:3] *= areas[...,None]
+    corner_terms[...,3] = areas
+    return corner_terms
+
+def rusinkiewicz_principal_curvatures(sums, coordinates):
+    """
+    Principal directions and curvatures from per-vertex sums of
+    rusinkiewicz_corner_terms, in the dtype of the sums. The 2x2 eigensolve
+    runs in float64.
+    """
+    dtype = sums.dtype
+    matrices, vertex_areas = sums[:,:3], sums[:,3]
+    has_area = vertex_areas > 0
+    matrices[has_area] /= vertex_areas[has_area,None]
+
+    eig_min, eig_max, cos, sin = principal_curvatures_2x2(*matrices.T.astype(np.float64, copy=False))
+    curvature_min, curvature_max = principal_directions(cos, sin, coordinates[:,0], coordinates[:,2])
+    return tuple(array.astype(dtype, copy=False) for array in (curvature_min, curvature_max, eig_min, eig_max))
+
+def sdf_curvature(sdf, points, eps=1e-3, chunk_size=65536):
+    """
+    Normals and principal curvatures of the zero level set of sdf at points on
+    it, from its finite difference gradient and Hessian.
+    """
+    n = len(points)
+    normals = np.empty((n, 3))
+    curvature_min, curvature_max = np.empty((n, 3)), np.empty((n, 3))
+    eig_min, eig_max = np.empty(n), np.empty(n)
+    with stage("sdf_derivatives", points=n):
+        for start in range(0, n, chunk_size):
+            rows = slice(start, start + chunk_size)
+            _, gradient, hessian = sdf_derivatives(sdf, points[rows], eps)
+            length = np.maximum(np.linalg.norm(gradient, axis=-1), 1e-12)
+            normals[rows] = gradient / length[:,None]
+            coordinates = compute_tangent_frames(normals[rows])
+            tax, taz = coordinates[:,0], coordinates[:,2]
+            L, M, N = (np.einsum("ni,nij,nj->n", a, hessian, b) / length for a, b in ((tax, tax), (tax, taz), (taz, taz)))
+            eig_min[rows], eig_max[rows], cos, sin = principal_curvatures_2x2(L, M, N)
+            curvature_min[rows], curvature_max[rows] = principal_directions(cos, sin, tax, taz)
+    return normals, CurvatureResult(curvature_min, curvature_max, eig_min, eig_max)
+
+ESTIMATORS = {
+    "taubin": taubin_curvature,
+    "rusinkiewicz": rusinkiewicz_curvature,
+}
+
+def compute_curvature(mesh, estimators=("taubin", "rusinkiewicz"), topology=None):
+    """
+    Run several estimators on a mesh, computing the normals, adjacency and
+    areas they share only once. Returns a dict of CurvatureResult by
+    estimator name.
+    """
+    mesh = as_mesh(mesh)
+    with stage("curvature", vertices=len(mesh.vertices), faces=len(mesh.triangles)):
+        normals = mesh.normals
+        if topology is None:
+            topology = get_topology(mesh)
+        results = {}
+        for name in estimators:
+            with stage(name):
+                results[name] = ESTIMATORS[name](mesh.vertices, normals, topology)
+        return results
+
+# upper triangle of a symmetric 3x3 tensor, and the slot of each full entry
+TENSOR_INDICES = ([0, 0, 0, 1, 1, 2], [0, 1, 2, 1, 2, 2])
+TENSOR_SLOTS = [0, 1, 2, 1, 3, 4, 2, 4, 5]
+
+def curvature_tensors(curvature):
+    """Tensors k_min d_min d_min^T + k_max d_max d_max^T, as their upper triangles (n, 6)."""
+    i, j = TENSOR_INDICES
+    d_min, d_max = curvature.curvature_min, curvature.curvature_max
+    return (curvature.eig_min[:,None] * d_min[:,i] * d_min[:,j]
+        + curvature.eig_max[:,None] * d_max[:,i] * d_max[:,j])
+
+def tensor_curvature(tensors, normals):
+    """Principal directions and curvatures of tensors (n, 6) restricted to the tangent planes of normals."""
+    dtype = tensors.dtype
+    full = tensors[:,TENSOR_SLOTS].reshape(-1, 3, 3).astype(np.float64, copy=False)
+    coordinates = compute_tangent_frames(np.asarray(normals, dtype=np.float64))
+    tax, taz = coordinates[:,0], coordinates[:,2]
+    L, M, N = (np.einsum("ni,nij,nj->n", a, full, b) for a, b in ((tax, tax), (tax, taz), (taz, taz)))
+    eig_min, eig_max, cos, sin = principal_curvatures_2x2(L, M, N)
+    curvature_min, curvature_max = principal_directions(cos, sin, tax, taz)
+    return tuple(array.astype(dtype, copy=False) for array in (curvature_min, curvature_max, eig_min, eig_max))
+
+def smoothing_operator(topology):
+    """
+    Sparse (n, n) CSR matrix averaging a per-vertex field over each vertex
+    and its neighbors, weighted by their Voronoi areas. Its k-th power
+    averages over the k-ring.
+    """
+    n = topology.num_vertices
+    areas = topology.vertex_sum(topology.corner_areas.reshape(-1))
+    neighbors = csr_matrix((areas[topology.neighbor_indices], topology.neighbor_indices, topology.neighbor_offsets), shape=(n, n))
+    # a tiny self weight keeps isolated and zero area vertices as they are
+    weights = (neighbors + diags(np.maximum(areas, np.finfo(areas.dtype).tiny))).tocsr()
+    return (diags(1 / np.asarray(weights.sum(axis=1)).ravel()) @ weights).tocsr()
+
+def smooth_curvature(mesh, curvature, rings, topology=None):
+    """
+    Curvature averaged over the k-ring of each vertex, a CurvatureResult for
+    each k in rings, at a cost of max(rings) sparse products.
+    """
+    mesh = as_mesh(mesh)
+    with stage("smooth", vertices=len(mesh.vertices), rings=max(rings)):
+        operator = smoothing_operator(topology if topology is not None else get_topology(mesh))
+        tensors = curvature_tensors(curvature)
+        results = {}
+        for k in range(1, max(rings) + 1):
+            tensors = operator @ tensors
+            if k in rings:
+                results[k] = CurvatureResult(*tensor_curvature(tensors, mesh.normals))
+    return [results[k] for k in rings]
+
+def mean_edge_length(mesh):
+    mesh = as_mesh(mesh)
+    topology = get_topology(mesh)
+    src = np.repeat(np.arange(topology.num_vertices), np.diff(topology.neighbor_offsets))
+    return float(np.mean(np.linalg.norm(mesh.vertices[topology.neighbor_indices] - mesh.vertices[src], axis=-1)))
+
+class IncrementalCurvature:
+    """
+    Curvature of a deforming mesh. update() recomputes only what the moved
+    vertices reach: their one-ring for Taubin, two-ring for Rusinkiewicz.
+    """
+
+    def __init__(self, vertices, triangles, taubin=False, dtype=np.float64):
+        self.vertices = np.array(vertices, dtype=dtype)
+        self.topology = MeshTopology(self.vertices, triangles)
+        self.taubin = taubin
+        n = self.topology.num_vertices
+        t = self.topology.triangles
+
+        a, b, c = self.vertices[t[:,0]], self.vertices[t[:,1]], self.vertices[t[:,2]]
+        self.face_normals = np.cross(b - a, c - a)
+        self.normals = normalize(self.topology.vertex_sum(np.repeat(self.face_normals, 3, axis=0)))
+        self.has_edges = np.diff(self.topology.corner_offsets) > 0
+        if taubin:
+            self.corner_terms = np.ascontiguousarray(taubin_corner_terms(self.vertices, self.normals, t, self.topology.face_areas))
+        else:
+            self.coordinates = compute_tangent_frames(self.normals)
+            self.corner_terms = rusinkiewicz_corner_terms(self.vertices, self.normals, self.coordinates, t, self.topology.corner_areas).reshape(-1, 4)
+        self.sums = self.topology.vertex_sum(self.corner_terms)
+
+        self.curvature_min = np.zeros((n, 3), dtype=dtype)
+        self.curvature_max = np.zeros((n, 3), dtype=dtype)
+        self.eig_min = np.zeros((n,), dtype=dtype)
+        self.eig_max = np.zeros((n,), dtype=dtype)
+        self._solve(np.arange(n))
+
+    @property
+    def curvature(self):
+        return CurvatureResult(self.curvature_min, self.curvature_max, self.eig_min, self.eig_max)
 
+    def _solve(self, rows):
+        if self.taubin:
+            result = taubin_principal_curvatures(self.sums[rows], self.normals[rows], self.has_edges[rows])
+        else:
+            result = rusinkiewicz_principal_curvatures(self.sums[rows], self.coordinates[rows])
+        for out, values in zip((self.curvature_min, self.curvature_max, self.eig_min, self.eig_max), result):
+            out[rows] = values
+
+    def update(self, indices, positions):
+        """Move vertices[indices] to positions and return the vertices whose curvature was recomputed."""
+        topology = self.topology
+        t = topology.triangles
+        self.vertices[indices] = positions
+        moved = np.unique(indices)
+
+        faces = topology.incident_faces(moved)
+        a, b, c = self.vertices[t[faces,0]], self.vertices[t[faces,1]], self.vertices[t[faces,2]]
+        self.face_normals[faces] = np.cross(b - a, c - a)
+        topology.face_areas[faces] = compute_face_areas(self.vertices, t[faces])
+        topology.corner_areas[faces] = compute_voronoi_area(a, b, c)
+
+        ring = np.unique(t[faces])
+        corners, starts = topology.corner_runs(ring)
+        self.normals[ring] = normalize(np.add.reduceat(self.face_normals[corners // 3], starts, axis=0))
+
+        faces = topology.incident_faces(ring)
+        corners = (3 * faces[:,None] + np.arange(3)).ravel()
+        if self.taubin:
+            self.corner_terms[corners] = taubin_corner_terms(self.vertices, self.normals, t[faces], topology.face_areas[faces])
+            dirty = ring
+        else:
+            self.coordinates[ring] = compute_tangent_frames(self.normals[ring])
+            terms = rusinkiewicz_corner_terms(self.vertices, self.normals, self.coordinates, t[faces], topology.corner_areas[faces])
+            self.corner_terms[corners] = terms.reshape(-1, 4)
+            dirty = np.unique(t[faces])
+
+        self.sums[dirty] = topology.vertex_sum(self.corner_terms, dirty)
+        self._solve(dirty)
+        return dirty
+
+def compute_vertex_normals(vertices, triangles, chunk_size=1000000, out=None):
+    """
+    Area-weighted vertex normals, matching TriangleMesh.compute_vertex_normals.
+    Triangles are streamed in chunks, so both arrays may be memory-mapped and
+    out may be a memory-mapped (n, 3) array.
+    """
+    n = vertices.shape[0]
+    if out is None:
+        out = np.zeros((n, 3), dtype=vertices.dtype)
+    else:
+        out[:] = 0
+    for start in range(0, triangles.shape[0], chunk_size):
+        t = np.asarray(triangles[start:start + chunk_size])
+        a, b, c = vertices[t[:,0]], vertices[t[:,1]], vertices[t[:,2]]
+        face_normals = np.cross(b - a, c - a)
+        np.add.at(out, t.ravel(), np.repeat(face_normals, 3, axis=0))
+    for start in range(0, n, chunk_size):
+        out[start:start + chunk_size] = normalize(out[start:start + chunk_size])
+    return out
+
+def build_tile_tree(points, leaf_size):
+    """
+    Median splits of points along their widest axis down to leaf_size. Returns
+    per-node (axis, split, left, right), leaves holding -1 and their tile number.
+    """
+    axis, split, left, right = [0], [0.0], [-1], [-1]
+    num_tiles = 0
+    stack = [(0, points)]
+    while stack:
+        node, p = stack.pop()
+        a = int(np.argmax(np.ptp(p, axis=0)))
+        s = np.median(p[:,a])
+        below = p[:,a] < s
+        if len(p) <= leaf_size or below.all() or not below.any():
+            right[node] = num_tiles
+            num_tiles += 1
+            continue
+        axis[node] = a
+        split[node] = s
+        for side, child_points in ((left, p[below]), (right, p[~below])):
+            side[node] = len(axis)
+            stack.append((len(axis), child_points))
+            axis.append(0); split.append(0.0); left.append(-1); right.append(-1)
+    return np.array(axis), np.array(split), np.array(left), np.array(right), num_tiles
+
+def find_tile(tile_tree, points):
+    axis, split, left, right, _ = tile_tree
+    flat = points.reshape(-1, 3)
+    node = np.zeros(flat.shape[0], dtype=np.int64)
+    inner = left[node] >= 0
+    while np.any(inner):
+        i = np.flatnonzero(inner)
+        go_left = flat[i, axis[node[i]]] < split[node[i]]
+        node[i] = np.where(go_left, left[node[i]], right[node[i]])
+        inner[i] = left[node[i]] >= 0
+    return right[node].reshape(points.shape[:-1])
+
+def bucket_by_tile(tile_ids, num_tiles, open_out, chunk_size=1000000):
+    """
+    Counting sort of rows by tile (-1 for none) in two streaming passes; tile t
+    holds order[offsets[t]:offsets[t+1]] with order = open_out(total).
+    """
+    n = tile_ids.shape[0]
+    counts = np.zeros(num_tiles, dtype=np.int64)
+    for start in range(0, n, chunk_size):
+        ids = np.asarray(tile_ids[start:start + chunk_size]).ravel()
+        counts += np.bincount(ids[ids >= 0], minlength=num_tiles)
+    offsets = np.zeros(num_tiles + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    order = open_out(int(offsets[-1]))
+
+    cursor = offsets[:-1].copy()
+    for start in range(0, n, chunk_size):
+        ids = np.asarray(tile_ids[start:start + chunk_size]).reshape(-1, np.prod(tile_ids.shape[1:], dtype=int))
+        rows = np.repeat(start + np.arange(len(ids)), ids.shape[1])
+        ids = ids.ravel()
+        rows, ids = rows[ids >= 0], ids[ids >= 0]
+        sort = np.argsort(ids, kind="stable")
+        rows, ids = rows[sort], ids[sort]
+        chunk_counts = np.bincount(ids, minlength=num_tiles)
+        chunk_starts = np.cumsum(chunk_counts) - chunk_counts
+        order[cursor[ids] + np.arange(len(ids)) - chunk_starts[ids]] = rows
+        cursor += chunk_counts
+    return offsets, order
+
+def compute_curvature_chunked(vertices, triangles, output_dir, taubin=False, tile_vertices=250000, chunk_size=1000000):
+    """
+    Out-of-core curvature estimators: the mesh is solved in spatial tiles plus
+    their halos, streaming the results into .npy files in output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
     n = vertices.shape[0]
     m = triangles.shape[0]
 
-    normals = np.array(mesh.vertex_normals)
-    vertex_areas = np.zeros((n), dtype=float)
-    matrices = np.zeros((n, 2, 2), dtype=float)
-    coordinates = np.zeros((n, 3, 3), dtype=float)
-    curvature_max = np.zeros((n, 3), dtype=float)
-    curvature_min = np.zeros((n, 3), dtype=float)
-    eig_max = np.zeros((n,), dtype=float)
-    eig_min = np.zeros((n,), dtype=float)
-    confidence = np.zeros((n,), dtype=float)
-
-    for i in range(n):
-        test = rand_vec((3,))
-        while np.linalg.norm(np.cross(test, normals[i])) < 5e-1:
-            test = rand_vec((3,))
-        coordinates[i,0,:] = normalize(test - np.dot(test, normals[i]) * normals[i])
-        coordinates[i,1,:] = normals[i]
-        coordinates[i,2,:] = normalize(np.cross(coordinates[i,0,:], coordinates[i,1,:]))
-
-    for i in range(m):
-        triangle = vertices[triangles[i,0]], vertices[triangles[i,1]], vertices[triangles[i,2]]
-        areas = compute_voronoi_area(*triangle)
-        for ja in range(3):
-            jb = (ja+1)%3
-            jc = (ja+2)%3
-            idxA = triangles[i,ja]
-            idxB = triangles[i,jb]
-            idxC = triangles[i,jc]
-            tax, tay, taz = coordinates[idxA,0], coordinates[idxA,1], coordinates[idxA,2]
-            area = areas[ja]
-            if area < 1e-8:
+    def open_output(name, shape):
+        path = os.path.join(output_dir, name + ".npy")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=float, shape=shape)
+
+    with stage("normals", vertices=n):
+        normals = compute_vertex_normals(vertices, triangles, chunk_size, open_output("normals", (n, 3)))
+    curvature_min = open_output("curvature_min", (n, 3))
+    curvature_max = open_output("curvature_max", (n, 3))
+    eig_min = open_output("eig_min", (n,))
+    eig_max = open_output("eig_max", (n,))
+    confidence = open_output("confidence", (n,))
+
+    # tiles are the leaves of a median-split k-d tree over a strided sample
+    # of the vertices, so they stay balanced however the mesh is distributed
+    stride = max(1, n // chunk_size)
+    sample = np.asarray(vertices[::stride])
+    tile_tree = build_tile_tree(sample, max(1, tile_vertices // stride))
+    num_tiles = tile_tree[4]
+
+    # one streaming pass assigns every vertex its tile, and another the
+    # tiles of every face's corners; both are then bucketed by tile
+    scratch = []
+    def open_scratch(name, shape, dtype):
+        path = os.path.join(output_dir, name + ".npy")
+        scratch.append(path)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    with stage("assign_tiles", vertices=n, faces=m):
+        tile_ids = open_scratch("tile_ids", (n,), np.int32)
+        for start in range(0, n, chunk_size):
+            tile_ids[start:start + chunk_size] = find_tile(tile_tree, np.asarray(vertices[start:start + chunk_size]))
+        owned_offsets, owned_order = bucket_by_tile(
+            tile_ids, num_tiles, lambda size: open_scratch("owned", (size,), np.int64), chunk_size)
+
+        # a face is in the halo of each distinct tile of its corners
+        face_tiles = open_scratch("face_tiles", (m, 3), np.int32)
+        for start in range(0, m, chunk_size):
+            corner_tiles = np.sort(tile_ids[np.asarray(triangles[start:start + chunk_size])], axis=-1)
+            corner_tiles[:,1:][corner_tiles[:,1:] == corner_tiles[:,:-1]] = -1
+            face_tiles[start:start + chunk_size] = corner_tiles
+        halo_offsets, halo_order = bucket_by_tile(
+            face_tiles, num_tiles, lambda size: open_scratch("halo", (size,), np.int64), chunk_size)
+
+    estimator = taubin_curvature if taubin else rusinkiewicz_curvature
+    for tile in range(num_tiles):
+        with stage("tile") as record:
+            owned = np.asarray(owned_order[owned_offsets[tile]:owned_offsets[tile + 1]])
+            if owned.size == 0:
                 continue
-            ax = normalize(vertices[idxB] - vertices[idxA])
-            ay = normalize(np.cross(vertices[idxB] - vertices[idxA], vertices[idxC] - vertices[idxA]))
-            az = normalize(np.cross(ax, ay))
-            proj = np.array([ax, ay, az])
-
-            edgeA = (proj @ (vertices[idxC] - vertices[idxB]))[[0,2]]
-            edgeB = (proj @ (vertices[idxC] - vertices[idxA]))[[0,2]]
-            edgeC = (proj @ (vertices[idxB] - vertices[idxA]))[[0,2]]
-
-            #inv(proj.T) = proj
-            dnA = (proj @ (normals[idxC] - normals[idxB]))[[0,2]]
-            dnB = (proj @ (normals[idxC] - normals[idxA]))[[0,2]]
-            dnC = (proj @ (normals[idxB] - normals[idxA]))[[0,2]]
-
-            A = np.array(
-                [
-                    [edgeA[0], edgeA[1], 0],
-                    [0, edgeA[0], edgeA[1]],
-                    [edgeB[0], edgeB[1], 0],
-                    [0, edgeB[0], edgeB[1]],
-                    [edgeC[0], edgeC[1], 0],
-                    [0, edgeC[0], edgeC[1]],
-                ],
-                dtype=float
-            )
-            b = np.array(
-                [
-                    dnA[0],
-                    dnA[1],
-                    dnB[0],
-                    dnB[1],
-                    dnC[0],
-                    dnC[1],
-                ],
-                dtype=float
-            )
-
-            x = np.linalg.inv(A.T @ A) @ A.T @ b
-            LMN_local = np.array([[x[0], x[1]], [x[1], x[2]]], dtype=float)
-
-            rot_axis = normalize(np.cross(ay, tay))
-            if abs(np.dot(ay, tay)) > 1:
-                print(ay, tay, np.dot(ay, tay), "???")
-            rot_theta = np.arccos(np.clip(np.dot(ay, tay), -1, 1))
-            rot = Rotation.from_rotvec(rot_theta * rot_axis).as_matrix()
-
-            rax = rot @ ax
-            raz = rot @ az
-            L = np.dot(np.array([np.dot(tax, rax), np.dot(tax, raz)]), LMN_local @ np.array([np.dot(tax, rax), np.dot(tax, raz)]))
-            M = np.dot(np.array([np.dot(tax, rax), np.dot(tax, raz)]), LMN_local @ np.array([np.dot(taz, rax), np.dot(taz, raz)]))
-            N = np.dot(np.array([np.dot(taz, rax), np.dot(taz, raz)]), LMN_local @ np.array([np.dot(taz, rax), np.dot(taz, raz)]))
-
-            vertex_areas[idxA] += area
-            matrices[idxA,:,:] += np.array([[L, M], [M, N]]) * area
-    
-    for i in range(n):
-        if vertex_areas[i] > 0:
-            matrices[i] /= vertex_areas[i]
-        eigvals, eigvecs = eig(matrices[i])
-        eigvals = eigvals.real
-        eigvecs = eigvecs.real
-        up_proj = coordinates[i,[0,2],:].T
-        argmin = 0 if eigvals[0] < eigvals[1] else 1
-        curvature_min[i,:] = normalize(up_proj @ eigvecs[:,argmin])
-        curvature_max[i,:] = normalize(up_proj @ eigvecs[:,argmin^1])
-        eig_min[i] = eigvals[argmin]
-        eig_max[i] = eigvals[argmin^1]
-
-    return curvature_min, curvature_max, eig_min, eig_max, confidence
+            # halo: every triangle touching an owned vertex, in global order
+            faces = np.asarray(triangles[np.asarray(halo_order[halo_offsets[tile]:halo_offsets[tile + 1]])])
+
+            local = np.union1d(faces.ravel(), owned)
+            record.update(vertices=len(local), faces=len(faces))
+            local_vertices = np.asarray(vertices[local])
+            topology = MeshTopology(local_vertices, np.searchsorted(local, faces))
+            result = estimator(local_vertices, np.asarray(normals[local]), topology)
+
+            keep = np.searchsorted(local, owned)
+            for out, values in zip((curvature_min, curvature_max, eig_min, eig_max, confidence), result):
+                out[owned] = values[keep]
+
+    for out in (normals, curvature_min, curvature_max, eig_min, eig_max, confidence):
+        out.flush()
+    del tile_ids, owned_order, face_tiles, halo_order
+    for path in scratch:
+        os.remove(path)
+    return CurvatureResult(curvature_min, curvature_max, eig_min, eig_max, confidence)
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+def read_ply_header(f):
+    """Format, elements as (name, count, properties) and the header length of a PLY file."""
+    if f.readline().strip() != b"ply":
+        raise ValueError("not a PLY file")
+    fmt, elements = None, []
+    for line in iter(f.readline, b""):
+        words = line.decode("ascii").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "end_header":
+            return fmt, elements, f.tell()
+        if words[0] == "format":
+            fmt = words[1]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property" and words[1] == "list":
+            elements[-1][2].append((words[4], (words[2], words[3])))
+        elif words[0] == "property":
+            elements[-1][2].append((words[2], words[1]))
+    raise ValueError("PLY header has no end_header")
+
+def stream_ply(path, output_dir, chunk_size=1000000):
+    """
+    Copy the vertex positions and triangles of a PLY file into memory-mapped
+    output_dir/vertices.npy (float64) and triangles.npy (int32), chunk by
+    chunk, without loading the whole file. Faces must all be triangles.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    def open_output(name, shape, dtype):
+        return np.lib.format.open_memmap(os.path.join(output_dir, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+    with open(path, "rb") as f:
+        fmt, elements, offset = read_ply_header(f)
+        names = [name for name, _, _ in elements]
+        if "vertex" not in names or "face" not in names:
+            raise ValueError("{} has no vertex or face element".format(path))
+        vertices = triangles = None
+        for name, count, properties in elements[:max(names.index("vertex"), names.index("face")) + 1]:
+            lists = [prop for prop, kind in properties if isinstance(kind, tuple)]
+            if name == "face" and len(properties) != 1 or name != "face" and lists:
+                raise ValueError("{}: unsupported PLY {} properties".format(path, name))
+            if name == "vertex":
+                columns = [prop for prop, _ in properties]
+                xyz = [columns.index(axis) for axis in "xyz"]
+                vertices = open_output("vertices", (count, 3), np.float64)
+            elif name == "face":
+                triangles = open_output("triangles", (count, 3), np.int32)
+
+            if fmt == "ascii":
+                for start in range(0, count, chunk_size):
+                    lines = [line.decode("ascii") for line in itertools.islice(f, min(chunk_size, count - start))]
+                    if name == "vertex":
+                        vertices[start:start + len(lines)] = np.loadtxt(lines, usecols=xyz, ndmin=2)
+                    elif name == "face":
+                        faces = np.loadtxt(lines, dtype=np.int64, ndmin=2)
+                        if faces.shape[1] != 4 or np.any(faces[:,0] != 3):
+                            raise ValueError("{}: only triangle faces are supported".format(path))
+                        triangles[start:start + len(lines)] = faces[:,1:]
+                continue
+
+            if fmt not in ("binary_little_endian", "binary_big_endian"):
+                raise ValueError("{}: unknown PLY format {}".format(path, fmt))
+            if count == 0:
+                continue
+            order = "<" if fmt == "binary_little_endian" else ">"
+            if name == "face":
+                count_type, index_type = properties[0][1]
+                dtype = np.dtype([("n", order + PLY_TYPES[count_type]), ("v", order + PLY_TYPES[index_type], 3)])
+            else:
+                dtype = np.dtype([(prop, order + PLY_TYPES[kind]) for prop, kind in properties])
+            records = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+            for start in range(0, count, chunk_size):
+                chunk = records[start:start + chunk_size]
+                if name == "vertex":
+                    vertices[start:start + len(chunk)] = np.stack([chunk[axis] for axis in "xyz"], axis=-1)
+                elif name == "face":
+                    if np.any(chunk["n"] != 3):
+                        raise ValueError("{}: only triangle faces are supported".format(path))
+                    triangles[start:start + len(chunk)] = chunk["v"]
+            offset += count * dtype.itemsize
+            del records
+    return vertices, triangles
+
+def center_points_chunked(points, chunk_size=1000000):
+    """center_points for memory-mapped points, in streaming passes."""
+    n = len(points)
+    mean = sum(np.asarray(points[start:start + chunk_size]).sum(axis=0) for start in range(0, n, chunk_size)) / n
+    radius = max(np.linalg.norm(points[start:start + chunk_size] - mean, axis=-1).max() for start in range(0, n, chunk_size))
+    for start in range(0, n, chunk_size):
+        points[start:start + chunk_size] = (points[start:start + chunk_size] - mean) / radius
+    return points
 
 def get_lineset(vertices, vectors, color, l=0.01):
     n = vertices.shape[0]
     vertices = np.tile(vertices, (2, 1))
     vertices[n:,:] += vectors * l
-    colors = [color for i in range(n)]
-    lines = [[i, i+n] for i in range(n)]
+    colors = np.tile(np.asarray(color, dtype=float), (n, 1))
+    lines = np.stack([np.arange(n), np.arange(n) + n], axis=-1)
     line_set = o3d.geometry.LineSet(
         points=o3d.utility.Vector3dVector(vertices),
         lines=o3d.utility.Vector2iVector(lines),
@@ -310,21 +974,22 @@ def visualize(geometries, window_name="", screenshot_path=None):
     vis.destroy_window()
 
 def visualize_curvature_directions(mesh, l=0.01, show_normals=False, show_curvature=True, taubin=False, save_path=None):
-    mesh.compute_vertex_normals()
-    vertices = np.array(mesh.vertices)
-    normals = np.array(mesh.vertex_normals)
+    mesh = as_mesh(mesh)
+    vertices = mesh.vertices
+    normals = mesh.normals
     n = vertices.shape[0]
     if taubin:
-        curvature_min, curvature_max, eig_min, eig_max, _ = compute_curvature_directions_taubin(mesh)
+        result = compute_curvature_directions_taubin(mesh)
     else:
-        curvature_min, curvature_max, eig_min, eig_max, _ = compute_curvature_directions_rusinkiewicz(mesh)
-    
+        result = compute_curvature_directions_rusinkiewicz(mesh)
+    curvature_min, curvature_max = result.curvature_min, result.curvature_max
+
 
     line_set_max = get_lineset(vertices, curvature_max, [1, 0, 0])
     line_set_min = get_lineset(vertices, curvature_min, [0, 1, 0])
     line_set_normal = get_lineset(vertices, normals, [0, 0, 1])
 
-    geometries = [mesh, line_set_min, line_set_max]
+    geometries = [mesh.o3d, line_set_min, line_set_max]
     if show_normals:
         geometries += [line_set_normal]
     if save_path is not None:
@@ -333,27 +998,39 @@ def visualize_curvature_directions(mesh, l=0.01, show_normals=False, show_curvat
         o3d.visualization.draw_geometries(geometries)
     
     if show_curvature:
-        old_colors = np.array(mesh.vertex_colors)
+        old_colors = np.array(mesh.o3d.vertex_colors)
         paint = cm.get_cmap("seismic")
-        gaussian_curvature = eig_min * eig_max
+        gaussian_curvature = result.gaussian
         print("Gaussian curvature:\t{:.4f}\t{:.4f}".format(gaussian_curvature.min(), gaussian_curvature.max()))
-        mesh.vertex_colors = o3d.utility.Vector3dVector(paint(gaussian_curvature/5 + 0.5)[:,:3])
-        o3d.visualization.draw_geometries([mesh])
+        mesh.o3d.vertex_colors = o3d.utility.Vector3dVector(paint(gaussian_curvature/5 + 0.5)[:,:3])
+        o3d.visualization.draw_geometries([mesh.o3d])
         paint = cm.get_cmap("PiYG")
-        mean_curvature = 1/2 * (eig_min + eig_max)
+        mean_curvature = result.mean
         print("Mean curvature:\t\t{:.4f}\t{:.4f}".format(mean_curvature.min(), mean_curvature.max()))
-        mesh.vertex_colors = o3d.utility.Vector3dVector(paint(mean_curvature/5 + 0.5)[:,:3])
-        o3d.visualization.draw_geometries([mesh])
-        mesh.vertex_colors = o3d.utility.Vector3dVector(old_colors)
+        mesh.o3d.vertex_colors = o3d.utility.Vector3dVector(paint(mean_curvature/5 + 0.5)[:,:3])
+        o3d.visualization.draw_geometries([mesh.o3d])
+        mesh.o3d.vertex_colors = o3d.utility.Vector3dVector(old_colors)
 
 def center_mesh(mesh):
-    vertices = np.array(mesh.vertices)
-    mean = np.mean(vertices, axis=0)
-    normalization = np.amax(np.linalg.norm(vertices-mean, axis=-1))
-    new_vertices = (vertices-mean)/normalization
-    mesh.vertices = o3d.utility.Vector3dVector(new_vertices)
+    # in place, through a writable view of the Open3D vertices
+    if isinstance(mesh, Mesh):
+        center_mesh(mesh.o3d)
+        mesh.invalidate()
+        return mesh
+    center_points(np.asarray(mesh.vertices))
     return mesh
 
+def center_points(points):
+    mean, radius = centering(points)
+    points -= mean
+    points /= radius
+    return points
+
+def centering(points):
+    """The mean and radius center_points maps points by: (points - mean) / radius."""
+    mean = np.mean(points, axis=0)
+    return mean, np.amax(np.linalg.norm(points - mean, axis=-1))
+
 #https://stackoverflow.com/questions/1447287/format-floats-with-standard-json-module
 def pretty_floats(obj):
     if isinstance(obj, float):
@@ -364,41 +1041,162 @@ def pretty_floats(obj):
         return list(map(pretty_floats, obj))
     return obj
 
-def write_data(mesh, filename, taubin=False):
-    mesh.compute_vertex_normals()
-    vertices = np.array(mesh.vertices).tolist()
-    normals = np.array(mesh.vertex_normals).tolist()
-    triangles = np.array(mesh.triangles).tolist()
-    #curvature_min, curvature_max = [[1,0,0] for i in range(len(vertices))], [[0,1,0] for i in range(len(vertices))]
-    if taubin:
-        curvature_min, curvature_max, _, _, _ = compute_curvature_directions_taubin(mesh)
+def write_binary(data, filename, quantize=False):
+    """
+    Write arrays as a binary asset for parseMeshBuffer in common/geometry.js,
+    4-byte aligned, quantized like export.py with quantize.
+    """
+    buffers, arrays, _ = pack_buffers(data, quantize=quantize)
+    write_buffers({"version": 1, "buffers": buffers}, arrays, filename)
+
+def write_binary_levels(levels, filename, quantize=False):
+    """
+    Write levels of detail, coarse to fine, as one binary asset that
+    streamMeshLevels in common/geometry.js can draw as it arrives.
+    """
+    header_levels = []
+    arrays = []
+    offset = 0
+    for data in levels:
+        start = offset
+        buffers, level_arrays, offset = pack_buffers(data, offset, quantize)
+        header_levels.append({
+            "triangles": len(data["triangles"]),
+            "vertices": len(data["positions"]),
+            "offset": start,
+            "length": offset - start,
+            "buffers": buffers,
+        })
+        arrays += level_arrays
+    write_buffers({"version": 2, "levels": header_levels}, arrays, filename)
+
+UNIT_VECTORS = ("normals", "curvature_min", "curvature_max")
+
+def pack_buffers(data, offset=0, quantize=False):
+    buffers = {}
+    arrays = []
+    for name, array in data.items():
+        array = np.asarray(array)
+        info = {}
+        if quantize and name in UNIT_VECTORS:
+            array = encode_octahedral(array)
+            info["encoding"] = "octahedral"
+        elif quantize and name == "positions" and len(array) > 0:
+            low, high = array.min(axis=0), array.max(axis=0)
+            array = encode_fixed(array, low, high)
+            info.update(encoding="fixed", min=low.tolist(), max=high.tolist())
+        elif quantize and np.issubdtype(array.dtype, np.integer) and array.size > 0 and array.max() < 1 << 16:
+            array = array.astype(np.uint16)
+        if array.dtype in (np.int16, np.uint16):
+            dtype = array.dtype.name
+        else:
+            dtype = "uint32" if np.issubdtype(array.dtype, np.integer) else "float32"
+        array = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder("<"))
+        buffers[name] = dict({
+            "offset": offset,
+            "dtype": dtype,
+            "count": array.shape[0],
+            "components": int(np.prod(array.shape[1:])),
+        }, **info)
+        arrays.append(array)
+        offset += array.nbytes
+        # keep the next buffer 4-byte aligned
+        if offset % 4:
+            arrays.append(np.zeros(-offset % 4, dtype=np.uint8))
+            offset += arrays[-1].nbytes
+    return buffers, arrays, offset
+
+def write_buffers(header, arrays, filename):
+    header = json.dumps(header).encode()
+    header += b" " * (-len(header) % 4)
+
+    with output_file(filename, "wb") as f:
+        f.write(np.array(len(header), dtype="<u4").tobytes())
+        f.write(header)
+        for array in arrays:
+            f.write(array.data)
+
+@contextlib.contextmanager
+def output_file(filename, mode):
+    """Open filename, or pass through an already open file object (e.g. io.BytesIO)."""
+    if isinstance(filename, (str, os.PathLike)):
+        with open(filename, mode) as f:
+            yield f
     else:
-        curvature_min, curvature_max, _, _, _ = compute_curvature_directions_rusinkiewicz(mesh)
-    curvature_min = curvature_min.tolist()
-    curvature_max = curvature_max.tolist()
-
-    for x in vertices:
-        assert x is not None
-    for x in normals:
-        assert x is not None
-    for x in curvature_min:
-        assert x is not None
-    for x in curvature_max:
-        assert x is not None
-
-    data = {
+        yield filename
+
+def mesh_data(mesh, curvature):
+    mesh = as_mesh(mesh)
+    vertices = mesh.vertices
+    normals = mesh.normals
+    triangles = mesh.triangles
+    curvature_min, curvature_max, _, _, _ = curvature
+
+    for x in (vertices, normals, curvature_min, curvature_max):
+        assert np.all(np.isfinite(x))
+
+    return {
         "positions": vertices,
         "triangles": triangles,
         "normals": normals,
         "curvature_min": curvature_min,
         "curvature_max": curvature_max,
     }
-    with open(filename, "w") as f:
-        json.dump(pretty_floats(data), f)
+
+def json_data(data):
+    with stage("pretty_floats", vertices=len(data["positions"])):
+        return pretty_floats(dict((k, v.tolist()) for k, v in data.items()))
+
+def write_json(obj, filename, vertices):
+    with stage("json_dump", vertices=vertices):
+        with output_file(filename, "w") as f:
+            json.dump(obj, f)
+
+def reorder_data(data):
+    """
+    Reorder the triangles of an asset for the vertex cache and renumber its
+    vertices by first use (see export.py), printing the ACMR before and after.
+    """
+    with stage("reorder", faces=len(data["triangles"])):
+        vertex_order, triangles = reorder_mesh(data["triangles"], len(data["positions"]))
+    print("ACMR {:.3f} -> {:.3f}".format(acmr(data["triangles"]), acmr(triangles)))
+    return dict((name, triangles if name == "triangles" else np.asarray(array)[vertex_order])
+        for name, array in data.items())
+
+def write_data(mesh, filename, taubin=False, binary=False, curvature=None, reorder=False, quantize=False):
+    mesh = as_mesh(mesh)
+    #curvature_min, curvature_max = [[1,0,0] for i in range(len(vertices))], [[0,1,0] for i in range(len(vertices))]
+    if curvature is None and taubin:
+        curvature = compute_curvature_directions_taubin(mesh)
+    elif curvature is None:
+        curvature = compute_curvature_directions_rusinkiewicz(mesh)
+
+    data = mesh_data(mesh, curvature)
+    if reorder:
+        data = reorder_data(data)
+    if binary:
+        with stage("write_binary", vertices=len(data["positions"])):
+            write_binary(data, filename, quantize)
+        return
+    write_json(json_data(data), filename, len(data["positions"]))
+
+def write_levels(levels, curvatures, filename, binary=False, reorder=False, quantize=False):
+    """Write levels of detail, coarse to fine, with their curvature as one asset."""
+    data = [mesh_data(mesh, curvature) for mesh, curvature in zip(levels, curvatures)]
+    if reorder:
+        data = [reorder_data(level) for level in data]
+    vertices = sum(len(level["positions"]) for level in data)
+    if binary:
+        with stage("write_binary", vertices=vertices):
+            write_binary_levels(data, filename, quantize)
+        return
+    write_json({"levels": [json_data(level) for level in data]}, filename, vertices)
 
 def compare_taubin_rusinkiewicz(mesh):
-    direction_minA, direction_maxA, eig_minA, eig_maxA, _ = compute_curvature_directions_taubin(mesh)
-    direction_minB, direction_maxB, eig_minB, eig_maxB, _ =  compute_curvature_directions_rusinkiewicz(mesh)
+    mesh = as_mesh(mesh)
+    results = compute_curvature(mesh)
+    direction_minA, direction_maxA, eig_minA, eig_maxA, _ = results["taubin"]
+    direction_minB, direction_maxB, eig_minB, eig_maxB, _ = results["rusinkiewicz"]
     for i in range(0, eig_minA.shape[0], 100):
         print(i, eig_minA[i], eig_maxA[i], eig_minB[i], eig_maxB[i])
         print("taubin\t", direction_minA[i], direction_maxA[i])
@@ -406,30 +1204,19 @@ def compare_taubin_rusinkiewicz(mesh):
     visualize_curvature_directions(mesh, taubin=True)
     visualize_curvature_directions(mesh, taubin=False)
 
-if __name__ == "__main__":
-    #mesh = o3d.io.read_triangle_mesh("../models/bunny/reconstruction/bun_zipper.ply")
-    #mesh = o3d.io.read_triangle_mesh("../models/csg.ply")
-    mesh = o3d.io.read_triangle_mesh("../models/teapot-fix.obj")
-    #mesh = mesh_from_sdf(1, 160)
-    mesh = center_mesh(mesh)
-    visualize_curvature_directions(mesh, taubin=False)
-
-    #mesh = o3d.geometry.TriangleMesh.create_torus(torus_radius=1.0, tube_radius=0.5, radial_resolution=90, tubular_resolution=60)
-    #mesh = o3d.geometry.TriangleMesh.create_sphere(radius=1.0, resolution=20)
-    #compare_taubin_rusinkiewicz(mesh)
-    exit()
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--source",
         default = "model",
-        choices = ["model", "sdf"],
+        choices = ["model", "sdf", "pointcloud"],
         required = True
     )
     parser.add_argument(
         "--input",
         type = str,
         required = False,
-        help = "input file (model)"
+        help = "input file (model, pointcloud)"
     )
     parser.add_argument(
         "--example",
@@ -437,18 +1224,111 @@ if __name__ == "__main__":
         type = int,
         help = "example (sdf)"
     )
+    parser.add_argument(
+        "--scene",
+        type = str,
+        required = False,
+        help = "JSON scene file, see sdf.py; overrides --example (sdf)"
+    )
     parser.add_argument(
         "--resolution",
         default = 100,
         type = int,
         help = "grid size n x n x n (sdf)"
     )
+    parser.add_argument(
+        "--precision",
+        default = "float64",
+        choices = ["float64", "float32"],
+        help = "floating point precision of the sdf grid and of the curvature computation, see Mesh.astype"
+    )
+    parser.add_argument(
+        "--threads",
+        default = None,
+        type = int,
+        help = "threads for sdf grid evaluation, defaults to the number of cores (sdf)"
+    )
+    parser.add_argument('--adaptive', dest='adaptive', action='store_true',
+        help = "sample the sdf only in a narrow band around the surface (sdf)")
+    parser.set_defaults(adaptive=False)
+    parser.add_argument('--analytic', dest='analytic', action='store_true',
+        help = "snap the vertices to the surface and take normals and curvature from the derivatives of the sdf instead of the mesh (sdf)")
+    parser.set_defaults(analytic=False)
+    parser.add_argument(
+        "--snap_steps",
+        default = 3,
+        type = int,
+        help = "Newton steps moving the vertices onto the surface (with --analytic)"
+    )
+    parser.add_argument(
+        "--neighbors",
+        default = 20,
+        type = int,
+        help = "nearest neighbors per point for normals and curvature fits (pointcloud)"
+    )
+    parser.add_argument(
+        "--radius",
+        default = None,
+        type = float,
+        help = "only use neighbors within this distance, after centering and scaling to the unit ball (pointcloud)"
+    )
+    parser.add_argument(
+        "--workers",
+        default = None,
+        type = int,
+        help = "worker processes, defaults to the number of cores (pointcloud)"
+    )
     parser.add_argument(
         "--output",
         type = str,
         required = True,
         help = "output file"
     )
+    parser.add_argument(
+        "--format",
+        default = "json",
+        choices = ["json", "binary"],
+        help = "output format: pretty-printed JSON, or float32/uint32 buffers behind a JSON header"
+    )
+    parser.add_argument('--reorder', dest='reorder', action='store_true',
+        help = "reorder triangles for the vertex cache and vertices by first use, printing the ACMR")
+    parser.set_defaults(reorder=False)
+    parser.add_argument('--quantize', dest='quantize', action='store_true',
+        help = "store normals and curvature directions octahedral-encoded and positions in fixed point (binary)")
+    parser.set_defaults(quantize=False)
+    parser.add_argument(
+        "--tiles",
+        type = str,
+        required = False,
+        help = "directory for out-of-core curvature computation (memory-mapped arrays); a PLY --input with --no-simplify is streamed into it without loading the mesh, other inputs are loaded whole first"
+    )
+    parser.add_argument(
+        "--tile_vertices",
+        default = 250000,
+        type = int,
+        help = "approximate number of vertices per tile (with --tiles)"
+    )
+    parser.add_argument(
+        "--cache",
+        type = str,
+        required = False,
+        help = "directory of the on-disk cache for loaded meshes and curvature"
+    )
+    parser.add_argument(
+        "--cache_size",
+        default = 2048,
+        type = int,
+        help = "cache size limit in MiB (least recently used entries are evicted)"
+    )
+    parser.add_argument('--profile', dest='profile', action='store_true',
+        help = "print the wall time, CPU time, peak memory and element counts of each stage")
+    parser.set_defaults(profile=False)
+    parser.add_argument(
+        "--profile_output",
+        type = str,
+        required = False,
+        help = "also write the --profile report to this JSON file"
+    )
     parser.add_argument('--taubin', dest='taubin', action='store_true')
     parser.set_defaults(taubin=False)
     parser.add_argument('--vis', dest='vis', action='store_true')
@@ -463,17 +1343,419 @@ if __name__ == "__main__":
         type = int,
         help = "number of triangles after simplification"
     )
-    args = parser.parse_args()
-    
+    parser.add_argument(
+        "--lods",
+        type = parse_lods,
+        required = False,
+        help = "comma separated triangle counts of levels of detail written to one asset, e.g. 2000,10000,50000,full; overrides --simplify and --target_num"
+    )
+    parser.add_argument(
+        "--simplify_mode",
+        default = "uniform",
+        choices = ["uniform", "curvature"],
+        help = "uniform: Open3D quadric decimation; curvature: quadric decimation weighted by a curvature estimate of the full mesh, keeping more triangles where it is curved"
+    )
+    parser.add_argument(
+        "--curvature_weight",
+        default = 4.0,
+        type = float,
+        help = "with --simplify_mode curvature, extra error weight of a vertex of average k1^2 + k2^2"
+    )
+    parser.add_argument(
+        "--smooth",
+        type = parse_rings,
+        required = False,
+        help = "comma separated k-ring sizes to average the curvature tensors over, e.g. 1,2,4; several sizes are written to one output each, named <output>_smooth<k>"
+    )
+    parser.add_argument(
+        "--smooth_radius",
+        type = parse_radii,
+        required = False,
+        help = "like --smooth, with geodesic radii (in units of the centered mesh) taken as that many mean edge lengths of rings; outputs are named <output>_radius<r>"
+    )
+    parser.add_argument('--fidelity', dest='fidelity', action='store_true',
+        help = "print how well the curvature of the simplified mesh matches that of the full resolution mesh")
+    parser.set_defaults(fidelity=False)
+    return parser
+
+def parse_lods(value):
+    """'2000,10000,full' -> [2000, 10000, None], coarse to fine (None keeps every triangle)."""
+    targets = set()
+    for item in value.split(","):
+        if item.strip() == "full":
+            targets.add(None)
+        elif int(item) > 0:
+            targets.add(int(item))
+        else:
+            raise argparse.ArgumentTypeError("invalid level {!r}".format(item))
+    return sorted(targets, key=lambda target: float("inf") if target is None else target)
+
+def simplify_mesh(mesh, target, mode="uniform", curvature_weight=4.0):
+    """
+    Decimate a Mesh or Open3D mesh to target triangles, returning the same kind.
+    Curvature mode keeps more triangles where k1^2 + k2^2 is large.
+    """
+    full = as_mesh(mesh)
+    with stage("simplify", faces=target) as record:
+        if mode == "uniform":
+            simplified = Mesh(full.o3d.simplify_quadric_decimation(target))
+        else:
+            curvature = compute_curvature_directions_rusinkiewicz(full)
+            average = smoothing_operator(full.topology)
+            curvedness = average @ (average @ (curvature.eig_min**2 + curvature.eig_max**2))
+            weights = 1 + curvature_weight * curvedness / max(np.mean(curvedness), 1e-300)
+            simplified = Mesh.from_arrays(*decimate(full.vertices, full.triangles, target, weights))
+            record.update(vertices=len(simplified.vertices))
+    return simplified if isinstance(mesh, Mesh) else simplified.o3d
+
+def parse_scales(value, cast):
+    scales = []
+    for item in value.split(","):
+        scale = cast(item)
+        if not scale > 0:
+            raise argparse.ArgumentTypeError("invalid scale {!r}".format(item))
+        scales.append(scale)
+    return scales
+
+def parse_rings(value):
+    """'1,2,4' -> [1, 2, 4]"""
+    return parse_scales(value, int)
+
+def parse_radii(value):
+    """'0.02,0.05' -> [0.02, 0.05]"""
+    return parse_scales(value, float)
+
+def smoothing_scales(args, mesh):
+    """(name, rings) of each --smooth or --smooth_radius scale, or an empty list."""
+    if args.smooth is not None:
+        return [("smooth{}".format(k), k) for k in args.smooth]
+    if args.smooth_radius is not None:
+        edge = mean_edge_length(mesh)
+        return [("radius{:g}".format(r), max(1, int(np.ceil(r / edge)))) for r in args.smooth_radius]
+    return []
+
+def smoothed_curvatures(mesh, curvature, args):
+    """The curvature of mesh smoothed at each scale of args, or just [curvature] without smoothing."""
+    scales = smoothing_scales(args, mesh)
+    if not scales:
+        return [curvature]
+    return smooth_curvature(mesh, curvature, [rings for _, rings in scales])
+
+def scale_output(filename, name):
+    root, ext = os.path.splitext(filename)
+    return "{}_{}{}".format(root, name, ext)
+
+def decimate_levels(mesh, targets, mode="uniform", curvature_weight=4.0):
+    """
+    Levels of detail for increasing triangle targets (None keeps the mesh),
+    coarse to fine, each decimated from the next finer one.
+    """
+    levels = []
+    for target in reversed(targets):
+        if target is not None and target < len(mesh.triangles):
+            mesh = simplify_mesh(mesh, target, mode, curvature_weight)
+        levels.append(mesh)
+    return levels[::-1]
+
+CURVATURE_FIELDS = CurvatureResult.FIELDS
+
+def mesh_cache_key(args, cache):
     if args.source == "model":
-        mesh = o3d.io.read_triangle_mesh(args.input)
+        source = {"input": cache.file_digest(args.input)}
     else:
-        mesh = mesh_from_sdf(args.example, args.resolution)
-    
+        source = {"resolution": args.resolution, "precision": args.precision}
+        if args.scene is not None:
+            source["scene"] = cache.file_digest(args.scene)
+        else:
+            source["example"] = args.example
+    if args.simplify_mode != "uniform":
+        source.update(simplify_mode=args.simplify_mode, curvature_weight=args.curvature_weight)
+    if args.lods is not None:
+        return cache.key("mesh", source=args.source, lods=args.lods, **source)
+    target_num = args.target_num if args.simplify else None
+    return cache.key("mesh", source=args.source, target_num=target_num, **source)
+
+def load_source(args):
+    with stage("load") as record:
+        if args.source == "model":
+            mesh = o3d.io.read_triangle_mesh(args.input)
+        else:
+            scene = load_scene(args.scene) if args.scene is not None else None
+            mesh = mesh_from_sdf(args.example, args.resolution, adaptive=args.adaptive, dtype=np.dtype(args.precision), threads=args.threads, scene=scene)
+        record.update(vertices=len(mesh.vertices), faces=len(mesh.triangles))
+    if len(mesh.triangles) == 0:
+        raise ValueError("no triangles in {}".format(args.input if args.source == "model" else "sdf"))
+    return mesh
+
+def load_simplified(args, source=None):
+    mesh = load_source(args) if source is None else source
     if args.simplify:
-        mesh = mesh.simplify_quadric_decimation(args.target_num)
+        mesh = simplify_mesh(mesh, args.target_num, args.simplify_mode, args.curvature_weight)
+    return mesh
+
+def load_mesh(args, cache=None, source=None):
+    """
+    Load, simplify and center the mesh given by args. source is an Open3D
+    mesh from load_source to start from instead of loading it again; it may
+    be modified in place.
+    """
+    return load_centered(args, cache, source)[0]
+
+def load_centered(args, cache=None, source=None):
+    """load_mesh, and the (mean, radius) it was centered with (see centering)."""
+    if cache is not None:
+        arrays = cache.load(mesh_cache_key(args, cache))
+        if arrays is not None and "center" in arrays:
+            return Mesh.from_arrays(arrays["vertices"], arrays["triangles"]), (arrays["center"][:3], arrays["center"][3])
+
+    mesh = Mesh(load_simplified(args, source))
+    mean, radius = centering(mesh.vertices)
+    center_mesh(mesh)
+    if cache is not None:
+        cache.store(mesh_cache_key(args, cache), {
+            "vertices": mesh.vertices,
+            "triangles": mesh.triangles,
+            "center": np.append(mean, radius),
+        })
+    return mesh, (mean, radius)
+
+def load_levels(args, cache=None, source=None):
+    """
+    Levels of detail for args.lods, coarse to fine, centered together. source
+    is the Open3D mesh to start from instead of loading it (see load_mesh).
+    """
+    if cache is not None:
+        arrays = cache.load(mesh_cache_key(args, cache))
+        if arrays is not None:
+            return [Mesh.from_arrays(arrays["vertices{}".format(i)], arrays["triangles{}".format(i)])
+                for i in range(len(args.lods))]
+
+    # center before decimating, so that every level gets the same transform
+    if source is None:
+        source = load_source(args)
+    levels = [Mesh(level) for level in decimate_levels(center_mesh(source), args.lods, args.simplify_mode, args.curvature_weight)]
+    if cache is not None:
+        arrays = {}
+        for i, level in enumerate(levels):
+            arrays["vertices{}".format(i)] = level.vertices
+            arrays["triangles{}".format(i)] = level.triangles
+        cache.store(mesh_cache_key(args, cache), arrays)
+    return levels
 
-    mesh = center_mesh(mesh)
+def run_pointcloud(args, cache=None):
+    """
+    Curvature of a point cloud file, see pointcloud.py, written like a mesh
+    asset with no triangles.
+    """
+    if args.lods is not None or args.tiles is not None:
+        raise ValueError("--lods and --tiles need a mesh source")
+    arrays = None
+    if cache is not None:
+        key = cache.key("pointcloud", input=cache.file_digest(args.input),
+            neighbors=args.neighbors, radius=args.radius, precision=args.precision)
+        arrays = cache.load(key)
+    if arrays is None:
+        with stage("load") as record:
+            cloud = o3d.io.read_point_cloud(args.input)
+            points = center_points(np.array(cloud.points))
+            record.update(points=len(points))
+        if len(points) == 0:
+            raise ValueError("no points in {}".format(args.input))
+        normals = np.array(cloud.normals) if cloud.has_normals() else None
+        normals, *result = pointcloud_curvature(points, normals, neighbors=args.neighbors, radius=args.radius, workers=args.workers)
+        arrays = dict(zip(CURVATURE_FIELDS, CurvatureResult(*result)), vertices=points, normals=normals)
+        arrays = dict((name, array.astype(args.precision)) for name, array in arrays.items())
+        if cache is not None:
+            cache.store(key, arrays)
+    mesh = Mesh.from_arrays(arrays["vertices"], np.zeros((0, 3)), arrays["normals"], dtype=np.dtype(args.precision))
+    curvature = CurvatureResult(*(arrays[name] for name in CURVATURE_FIELDS))
     if args.vis:
-        visualize_curvature_directions(mesh, taubin=args.taubin)
-    write_data(mesh, args.output, taubin=args.taubin)
+        o3d.visualization.draw_geometries([
+            o3d.geometry.PointCloud(o3d.utility.Vector3dVector(mesh.vertices.astype(np.float64))),
+            get_lineset(mesh.vertices, curvature.curvature_min, [0, 1, 0]),
+            get_lineset(mesh.vertices, curvature.curvature_max, [1, 0, 0]),
+        ])
+    write_data(mesh, args.output, binary=args.format == "binary", curvature=curvature, reorder=args.reorder, quantize=args.quantize)
+
+def run_sdf_analytic(args, cache=None):
+    """
+    Mesh of an sdf source snapped to the surface, with normals and curvature
+    from the sdf itself, centered like load_mesh.
+    """
+    if args.source != "sdf" or args.lods is not None or args.tiles is not None:
+        raise ValueError("--analytic needs --source sdf, without --lods or --tiles")
+    arrays = None
+    if cache is not None:
+        key = cache.key("sdf_curvature", mesh=mesh_cache_key(args, cache), snap_steps=args.snap_steps)
+        arrays = cache.load(key)
+    if arrays is None:
+        scene = load_scene(args.scene if args.scene is not None else EXAMPLES[args.example])
+        sdf = compile_scene(scene)
+        mesh = load_simplified(args)
+        n = args.resolution
+        with stage("snap", vertices=len(mesh.vertices), steps=args.snap_steps):
+            points = snap_to_surface(sdf, grid_to_scene(np.asarray(mesh.vertices, dtype=np.float64), n), args.snap_steps)
+        normals, curvature = sdf_curvature(sdf, points)
+
+        vertices = scene_to_grid(points, n)
+        scale = np.amax(np.linalg.norm(vertices - vertices.mean(axis=0), axis=-1))
+        center_points(vertices)
+        # grid_to_scene swaps x and y, a reflection: vectors are swapped the
+        # same way and curvatures keep their sign
+        swap = lambda vectors: vectors[:,[1,0,2]]
+        factor = 4 / (n - 1) * scale
+        arrays = dict(zip(CURVATURE_FIELDS, CurvatureResult(
+            swap(curvature.curvature_min), swap(curvature.curvature_max),
+            curvature.eig_min * factor, curvature.eig_max * factor)))
+        arrays.update(vertices=vertices, triangles=np.asarray(mesh.triangles), normals=swap(normals))
+        arrays = dict((name, array if name == "triangles" else array.astype(args.precision)) for name, array in arrays.items())
+        if cache is not None:
+            cache.store(key, arrays)
+    mesh = Mesh.from_arrays(arrays["vertices"], arrays["triangles"], arrays["normals"], dtype=np.dtype(args.precision))
+    curvature = CurvatureResult(*(arrays[name] for name in CURVATURE_FIELDS))
+    if args.vis:
+        o3d.visualization.draw_geometries([
+            mesh.o3d,
+            get_lineset(mesh.vertices, curvature.curvature_min, [0, 1, 0]),
+            get_lineset(mesh.vertices, curvature.curvature_max, [1, 0, 0]),
+        ])
+    write_data(mesh, args.output, binary=args.format == "binary", curvature=curvature, reorder=args.reorder, quantize=args.quantize)
+
+def mesh_curvature(mesh, args, cache=None, mesh_key=None, tiles=None):
+    if cache is not None:
+        curvature_key = cache.key("curvature", mesh=mesh_key, taubin=args.taubin, precision=args.precision)
+        arrays = cache.load(curvature_key)
+        if arrays is not None:
+            return CurvatureResult(*(arrays[name] for name in CURVATURE_FIELDS))
+    if tiles is not None:
+        os.makedirs(tiles, exist_ok=True)
+        for name, array in (("vertices", mesh.vertices), ("triangles", mesh.triangles)):
+            np.save(os.path.join(tiles, name + ".npy"), np.asarray(array))
+        curvature = compute_curvature_chunked(
+            np.load(os.path.join(tiles, "vertices.npy"), mmap_mode="r"),
+            np.load(os.path.join(tiles, "triangles.npy"), mmap_mode="r"),
+            tiles,
+            taubin=args.taubin,
+            tile_vertices=args.tile_vertices,
+        )
+    elif args.taubin:
+        curvature = compute_curvature_directions_taubin(mesh)
+    else:
+        curvature = compute_curvature_directions_rusinkiewicz(mesh)
+    if cache is not None:
+        cache.store(curvature_key, dict(zip(CURVATURE_FIELDS, curvature)))
+    return curvature
+
+def streams_input(args):
+    return args.tiles is not None and args.source == "model" and not args.simplify \
+        and args.input is not None and args.input.lower().endswith(".ply")
+
+def run_streamed(args):
+    """
+    --tiles on a PLY model without simplification, solved in memory-mapped
+    arrays in args.tiles so the mesh is never held in memory.
+    """
+    with stage("load") as record:
+        vertices, triangles = stream_ply(args.input, args.tiles)
+        record.update(vertices=len(vertices), faces=len(triangles))
+    if len(triangles) == 0:
+        raise ValueError("no triangles in {}".format(args.input))
+    center_points_chunked(vertices)
+    curvature = compute_curvature_chunked(vertices, triangles, args.tiles, taubin=args.taubin, tile_vertices=args.tile_vertices)
+    normals = np.load(os.path.join(args.tiles, "normals.npy"), mmap_mode="r")
+    mesh = Mesh.from_arrays(vertices, triangles, normals=normals)
+    write_data(mesh, args.output, binary=args.format == "binary", curvature=curvature, reorder=args.reorder, quantize=args.quantize)
+
+def report_fidelity(args, full, mesh, curvature, center):
+    """
+    Print the fidelity (see decimate.fidelity) of the curvature of the
+    simplified and centered mesh to that of the full resolution mesh, after
+    mapping the full mesh by the same center (mean, radius).
+    """
+    mean, radius = center
+    full = Mesh.from_arrays((full.vertices - mean) / radius, full.triangles)
+    estimate = compute_curvature_directions_taubin if args.taubin else compute_curvature_directions_rusinkiewicz
+    with stage("fidelity", vertices=len(full.vertices)):
+        result = fidelity(mesh.vertices, curvature, full.vertices, estimate(full))
+    print("fidelity of {} to {} triangles: direction error {:.2f} deg, curvature error {:.4f}".format(
+        len(mesh.triangles), len(full.triangles), result["direction_error"], result["curvature_error"]))
+
+def run_levels(args, cache=None):
+    levels = load_levels(args, cache)
+    if args.precision != "float64":
+        levels = [level.astype(np.dtype(args.precision)) for level in levels]
+    curvatures = []
+    for i, level in enumerate(levels):
+        with stage("level", faces=len(level.triangles)):
+            mesh_key = None if cache is None else cache.key("level", mesh=mesh_cache_key(args, cache), level=i)
+            tiles = None if args.tiles is None else os.path.join(args.tiles, "level{}".format(i))
+            curvature = mesh_curvature(level, args, cache, mesh_key, tiles)
+            curvatures.append(smoothed_curvatures(level, curvature, args)[0])
+    if args.vis:
+        visualize_curvature_directions(levels[-1], taubin=args.taubin)
+    write_levels(levels, curvatures, args.output, binary=args.format == "binary", reorder=args.reorder, quantize=args.quantize)
+
+def run(args):
+    if args.source in ("model", "pointcloud") and args.input is None:
+        raise ValueError("--source {} needs --input".format(args.source))
+    if streams_input(args):
+        unsupported = [option for option, used in (
+            ("--fidelity", args.fidelity),
+            ("--precision", args.precision != "float64"),
+            ("--vis", args.vis),
+            ("--cache", args.cache is not None),
+        ) if used]
+        if unsupported:
+            raise ValueError("{} not supported with --tiles on a streamed PLY input".format(", ".join(unsupported)))
+    if args.quantize and args.format != "binary":
+        raise ValueError("--quantize needs --format binary")
+    if args.fidelity and (args.source == "pointcloud" or args.analytic or args.lods is not None):
+        raise ValueError("--fidelity needs a single simplified mesh, without --lods or --analytic")
+    scales = args.smooth or args.smooth_radius or []
+    if args.smooth is not None and args.smooth_radius is not None:
+        raise ValueError("--smooth and --smooth_radius are exclusive")
+    if scales and (args.source == "pointcloud" or args.analytic or args.tiles is not None):
+        raise ValueError("--smooth and --smooth_radius need a mesh source, without --analytic or --tiles")
+    if len(scales) > 1 and (args.lods is not None or args.output == "-"):
+        raise ValueError("several smoothing scales need a single mesh and an output file")
+    with profile() if args.profile else contextlib.nullcontext() as profiler:
+        cache = None
+        if args.cache is not None:
+            cache = PipelineCache(args.cache, args.cache_size << 20)
+        if args.source == "pointcloud":
+            run_pointcloud(args, cache)
+        elif args.analytic:
+            run_sdf_analytic(args, cache)
+        elif args.lods is not None:
+            run_levels(args, cache)
+        elif streams_input(args):
+            run_streamed(args)
+        else:
+            source = full = None
+            if args.fidelity:
+                # a copy, since an unsimplified source is centered in place
+                source = load_source(args)
+                full = Mesh.from_arrays(np.array(source.vertices), np.array(source.triangles))
+            mesh, center = load_centered(args, cache, source)
+            if args.precision != "float64":
+                mesh = mesh.astype(np.dtype(args.precision))
+            if args.vis:
+                visualize_curvature_directions(mesh, taubin=args.taubin)
+            mesh_key = None if cache is None else mesh_cache_key(args, cache)
+            curvature = mesh_curvature(mesh, args, cache, mesh_key, args.tiles)
+            if args.fidelity:
+                report_fidelity(args, full, mesh, curvature, center)
+            scales = smoothing_scales(args, mesh)
+            if len(scales) > 1:
+                for (name, _), smoothed in zip(scales, smoothed_curvatures(mesh, curvature, args)):
+                    write_data(mesh, scale_output(args.output, name), binary=args.format == "binary", curvature=smoothed, reorder=args.reorder, quantize=args.quantize)
+            else:
+                curvature = smoothed_curvatures(mesh, curvature, args)[0]
+                write_data(mesh, args.output, taubin=args.taubin, binary=args.format == "binary", curvature=curvature, reorder=args.reorder, quantize=args.quantize)
+    if profiler is not None:
+        print(profiler.format_table())
+        if args.profile_output is not None:
+            profiler.write(args.profile_output)
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
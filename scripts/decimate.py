@@ -0,0 +1,298 @@
+"""
+Edge-collapse decimation with quadric error metrics (Garland and Heckbert,
+"Surface Simplification Using Quadric Error Metrics", 1997), with a weight
+per vertex that scales its quadric, so that regions of heavy vertices keep
+more triangles. curvature.simplify_mesh weights vertices by curvature.
+
+Collapses are done in passes over the whole mesh with numpy. Each pass
+ranks the cheapest edges and collapses those that are the cheapest within
+the one-rings of their endpoints; such collapses touch disjoint sets of
+faces, so they can be checked and applied together. A collapse is skipped
+if it would make the mesh non-manifold (the link condition), flip a
+triangle or leave a sliver.
+
+fidelity() compares a decimated curvature field to the full one.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+BOUNDARY_WEIGHT = 100.0
+# collapses may not leave triangles of lower quality (see triangle_quality)
+# than this, unless they replace worse ones
+MIN_QUALITY = 0.1
+# fraction of the edges, cheapest first, considered for collapse in a pass
+PASS_FRACTION = 0.25
+# the considered edges are split into this many cost buckets, in which they are shuffled
+PASS_BUCKETS = 8
+
+def face_normals(vertices, triangles):
+    """Unit normals (m, 3) and doubled areas (m,) of the faces."""
+    a, b, c = (vertices[triangles[:,i]] for i in range(3))
+    cross = np.cross(b - a, c - a)
+    area = np.linalg.norm(cross, axis=-1)
+    return cross / np.maximum(area, 1e-300)[:,None], area
+
+def triangle_quality(p):
+    """Shape of triangles p (m, 3, 3), 1 when equilateral and 0 when degenerate."""
+    a, b, c = p[:,0], p[:,1], p[:,2]
+    lengths = sum(np.einsum("ij,ij->i", e, e) for e in (b - a, c - b, a - c))
+    return 2 * np.sqrt(3) * np.linalg.norm(np.cross(b - a, c - a), axis=-1) / np.maximum(lengths, 1e-300)
+
+def face_quadrics(vertices, triangles):
+    """Area weighted plane quadrics (m, 4, 4) of the faces, and their unit normals."""
+    normals, area = face_normals(vertices, triangles)
+    a = vertices[triangles[:,0]]
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, a)[:,None]], axis=-1)
+    return 0.5 * area[:,None,None] * planes[:,:,None] * planes[:,None,:], normals
+
+def boundary_quadrics(vertices, triangles, face_normals):
+    """Quadrics of planes through boundary edges, perpendicular to their face."""
+    edges = np.stack([triangles, np.roll(triangles, -1, axis=1)], axis=-1).reshape(-1, 2)
+    faces = np.repeat(np.arange(len(triangles)), 3)
+    key = np.sort(edges, axis=1)
+    _, inverse, counts = np.unique(key, axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.ravel()] == 1
+    edges, faces = edges[boundary], faces[boundary]
+    a, b = vertices[edges[:,0]], vertices[edges[:,1]]
+    normals = np.cross(b - a, face_normals[faces])
+    length = np.linalg.norm(normals, axis=-1)
+    normals /= np.maximum(length, 1e-300)[:,None]
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, a)[:,None]], axis=-1)
+    quadrics = BOUNDARY_WEIGHT * length[:,None,None] * planes[:,:,None] * planes[:,None,:]
+    return edges, quadrics
+
+def quadric_costs(Q, positions):
+    """v^T Q v of quadrics Q (k, 4, 4) at positions (k, 3)."""
+    h = np.concatenate([positions, np.ones((len(positions), 1))], axis=-1)
+    return np.einsum("ki,ki->k", h, np.matmul(Q, h[:,:,None])[...,0])
+
+def collapse_targets(Q, a_pos, b_pos):
+    """Optimal positions (k, 3) and costs (k,) of collapsing edges with summed quadrics Q (k, 4, 4)."""
+    A, rhs = Q[:,:3,:3], -Q[:,:3,3]
+    det = np.linalg.det(A)
+    scale = np.einsum("kii->k", A) ** 3
+    solvable = np.abs(det) > 1e-12 * np.maximum(scale, 1e-300)
+    positions = (a_pos + b_pos) / 2
+    if solvable.any():
+        positions[solvable] = np.linalg.solve(A[solvable], rhs[solvable,:,None])[...,0]
+    costs = quadric_costs(Q, positions)
+    # fall back to the best of the endpoints and the midpoint
+    fallback = np.flatnonzero(~solvable)
+    if len(fallback):
+        candidates = np.stack([a_pos[fallback], b_pos[fallback], positions[fallback]], axis=1)
+        fallback_costs = np.stack([quadric_costs(Q[fallback], candidates[:,j]) for j in range(3)], axis=-1)
+        best = np.argmin(fallback_costs, axis=1)
+        rows = np.arange(len(fallback))
+        positions[fallback] = candidates[rows,best]
+        costs[fallback] = fallback_costs[rows,best]
+    return positions, np.maximum(costs, 0)
+
+def accumulate(indices, values, n):
+    """Sum values (k, ...) into n rows by index."""
+    flat = values.reshape(len(values), int(np.prod(values.shape[1:])))
+    sums = [np.bincount(indices, weights=flat[:,j], minlength=n) for j in range(flat.shape[1])]
+    return np.stack(sums, axis=-1).reshape((n,) + values.shape[1:])
+
+def mesh_edges(triangles, n):
+    """Unique edges (e, 2) of triangles, sorted by a * n + b, and the number of faces of each edge."""
+    halfedges = np.stack([triangles, np.roll(triangles, -1, axis=1)], axis=-1).reshape(-1, 2)
+    key = np.sort(halfedges, axis=1)
+    codes, counts = np.unique(key[:,0] * n + key[:,1], return_counts=True)
+    return np.stack([codes // n, codes % n], axis=-1), counts
+
+def incidence(keys, values, n):
+    """CSR offsets (n + 1,) and values grouped by key."""
+    order = np.argsort(keys)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(keys, minlength=n))])
+    return offsets, values[order]
+
+def gather(offsets, values, keys):
+    """Pairs (row, value) of every value of key keys[row]."""
+    counts = offsets[keys + 1] - offsets[keys]
+    rows = np.repeat(np.arange(len(keys)), counts)
+    starts = np.repeat(offsets[keys] - np.cumsum(counts) + counts, counts)
+    return rows, values[starts + np.arange(len(rows))]
+
+def ring_min(offsets, neighbor, keys, values):
+    """Minimum of values over the neighbors of each key."""
+    counts = offsets[keys + 1] - offsets[keys]
+    _, around = gather(offsets, neighbor, keys)
+    return np.minimum.reduceat(values[around], np.cumsum(counts) - counts)
+
+class Pass:
+    """The edges of the mesh at the start of a pass, and the checks of their collapses."""
+
+    def __init__(self, vertices, triangles, n):
+        self.vertices = vertices
+        self.triangles = triangles
+        self.face_normals, _ = face_normals(vertices, triangles)
+        self.face_quality = triangle_quality(vertices[triangles])
+        self.edges, self.counts = mesh_edges(triangles, n)
+        a, b = self.edges[:,0], self.edges[:,1]
+        self.neighbors = incidence(np.concatenate([a, b]), np.concatenate([b, a]), n)
+        self.faces = incidence(triangles.ravel(), np.repeat(np.arange(len(triangles)), 3), n)
+        self.boundary = np.zeros(n, dtype=bool)
+        self.boundary[self.edges[self.counts == 1].ravel()] = True
+
+    def valid(self, edges, positions):
+        """Whether collapsing each edge to its position keeps the mesh manifold and its faces unflipped and well shaped."""
+        a, b = self.edges[edges,0], self.edges[edges,1]
+        counts = self.counts[edges]
+        n = len(self.vertices)
+        # an interior edge between two boundary vertices would pinch the mesh
+        valid = ~((counts == 2) & self.boundary[a] & self.boundary[b])
+        # link condition: the only common neighbors are the opposite vertices of shared faces
+        offsets, neighbor = self.neighbors
+        rows_a, around_a = gather(offsets, neighbor, a)
+        rows_b, around_b = gather(offsets, neighbor, b)
+        common = np.intersect1d(rows_a * n + around_a, rows_b * n + around_b, assume_unique=True) // n
+        valid &= np.bincount(common, minlength=len(edges)) == counts
+        # no remaining face of a or b may flip, or get worse than MIN_QUALITY and the faces it replaces
+        worst = np.full(len(edges), MIN_QUALITY)
+        quality = []
+        for ends in (a, b):
+            rows, face = gather(self.faces[0], self.faces[1], ends)
+            np.minimum.at(worst, rows, self.face_quality[face])
+            t = self.triangles[face]
+            moved = (t == a[rows,None]) | (t == b[rows,None])
+            kept = moved.sum(axis=1) == 1
+            rows, face, t, moved = rows[kept], face[kept], t[kept], moved[kept]
+            p = self.vertices[t]
+            p[moved] = positions[rows]
+            cross = np.cross(p[:,1] - p[:,0], p[:,2] - p[:,0])
+            flipped = np.einsum("ij,ij->i", cross, self.face_normals[face]) <= 0
+            valid[rows[flipped]] = False
+            quality.append((rows, triangle_quality(p)))
+        for rows, q in quality:
+            valid[rows[q < worst[rows]]] = False
+        return valid
+
+    def independent(self, candidates, positions):
+        """
+        Valid collapses among candidates (edges in order of preference) that
+        have no endpoint in the one-rings of each other's endpoints, so that
+        they touch disjoint faces. Edges are taken in rounds: each round
+        takes the valid edges that come first within the one-rings of their
+        endpoints. Returns positions in candidates, in order; the invalid
+        edges found on the way are kept in rejected.
+        """
+        offsets, neighbor = self.neighbors
+        n = len(offsets) - 1
+        chosen = []
+        self.rejected = []
+        blocked = np.zeros(n, dtype=bool)
+        left = np.arange(len(candidates))
+        while len(left):
+            a, b = self.edges[candidates[left],0], self.edges[candidates[left],1]
+            lowest = np.full(n, len(candidates))
+            np.minimum.at(lowest, a, left)
+            np.minimum.at(lowest, b, left)
+            # the one-ring of b contains a and the other way round
+            first = left <= np.minimum(ring_min(offsets, neighbor, a, lowest), ring_min(offsets, neighbor, b, lowest))
+            valid = self.valid(candidates[left[first]], positions[left[first]])
+            cheapest = left[first][valid]
+            chosen.append(cheapest)
+            self.rejected.append(candidates[left[first][~valid]])
+            ends = self.edges[candidates[cheapest]].ravel()
+            blocked[ends] = True
+            blocked[gather(offsets, neighbor, ends)[1]] = True
+            # invalid edges are dropped without blocking their neighbors
+            dropped = np.zeros(len(left), dtype=bool)
+            dropped[np.flatnonzero(first)[~valid]] = True
+            left = left[~dropped & ~blocked[a] & ~blocked[b]]
+        return np.sort(np.concatenate(chosen))
+
+def decimate(vertices, triangles, target_faces, weights=None):
+    """
+    Collapse edges of a manifold triangle mesh until at most target_faces
+    triangles are left (or no valid collapse remains). weights (n,) scale
+    the vertex quadrics. Returns the new vertices and triangles.
+    """
+    vertices = np.array(vertices, dtype=np.float64)
+    triangles = np.array(triangles, dtype=np.int64)
+    n = len(vertices)
+    quadrics, normals = face_quadrics(vertices, triangles)
+    Q = accumulate(triangles.ravel(), np.repeat(quadrics, 3, axis=0), n)
+    edges, boundary = boundary_quadrics(vertices, triangles, normals)
+    Q += accumulate(edges.ravel(), np.repeat(boundary, 2, axis=0), n)
+    if weights is not None:
+        Q *= np.asarray(weights, dtype=np.float64)[:,None,None]
+
+    # collapse targets of the previous pass are kept for edges whose
+    # endpoints did not move, and rejections for edges whose one-rings did not
+    codes, positions, costs = np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros(0)
+    invalid = np.zeros(0, dtype=bool)
+    moved = np.ones(n, dtype=bool)
+    fraction = PASS_FRACTION
+    while len(triangles) > target_faces:
+        step = Pass(vertices, triangles, n)
+        a, b = step.edges[:,0], step.edges[:,1]
+        stale = moved[a] | moved[b]
+        kept = np.searchsorted(codes, a[~stale] * n + b[~stale])
+        near = moved.copy()
+        near[gather(*step.neighbors, np.flatnonzero(moved))[1]] = True
+        old_positions, old_costs, old_invalid = positions, costs, invalid
+        codes = a * n + b
+        positions, costs = np.empty((len(codes), 3)), np.empty(len(codes))
+        positions[~stale], costs[~stale] = old_positions[kept], old_costs[kept]
+        a_stale, b_stale = a[stale], b[stale]
+        positions[stale], costs[stale] = collapse_targets(Q[a_stale] + Q[b_stale], vertices[a_stale], vertices[b_stale])
+        invalid = np.zeros(len(codes), dtype=bool)
+        invalid[~stale] = old_invalid[kept]
+        invalid[near[a] | near[b]] = False
+
+        pool = np.flatnonzero(~invalid)
+        if len(pool) == 0:
+            break
+        size = max(1, int(fraction * len(pool)))
+        pool = pool[np.argpartition(costs[pool], size - 1)[:size]]
+        pool = pool[np.argsort(costs[pool], kind="stable")]
+        # shuffling edges of similar cost spreads the collapses of a pass over the mesh
+        bucket = np.arange(len(pool)) * PASS_BUCKETS // len(pool)
+        pool = pool[np.lexsort((pool * 2654435761 % 2**32, bucket))]
+        chosen = pool[step.independent(pool, positions[pool])]
+        invalid[np.concatenate(step.rejected)] = True
+        if len(chosen) == 0 and fraction < 1:
+            # none of the cheapest edges can be collapsed, try all of them
+            fraction = 1
+            moved[:] = False
+            continue
+        fraction = PASS_FRACTION
+        # stop at the target: each collapse removes the faces of its edge
+        chosen = chosen[np.cumsum(step.counts[chosen]) <= len(triangles) - target_faces]
+        if len(chosen) == 0:
+            break
+        a, b = a[chosen], b[chosen]
+        vertices[a] = positions[chosen]
+        Q[a] += Q[b]
+        moved[:] = False
+        moved[a] = True
+        remap = np.arange(n)
+        remap[b] = a
+        triangles = remap[triangles]
+        triangles = triangles[(triangles[:,0] != triangles[:,1]) & (triangles[:,1] != triangles[:,2]) & (triangles[:,2] != triangles[:,0])]
+
+    used = np.unique(triangles)
+    index = np.zeros(n, dtype=np.int64)
+    index[used] = np.arange(len(used))
+    return vertices[used], index[triangles].astype(np.int32)
+
+def fidelity(vertices, result, full_vertices, full_result):
+    """
+    How well a decimated curvature field matches the full one, compared at
+    every full resolution vertex with the nearest decimated vertex:
+    direction_error is the mean angle in degrees between the directions of
+    maximum curvature, weighted by the full field's confidence (directions
+    are undetermined at umbilics); curvature_error is the RMS difference of
+    the principal curvatures relative to their RMS on the full mesh.
+    """
+    _, nearest = cKDTree(vertices).query(full_vertices)
+    cos = np.abs(np.einsum("ij,ij->i", full_result.curvature_max, result.curvature_max[nearest]))
+    angle = np.degrees(np.arccos(np.clip(cos, 0, 1)))
+    confidence = full_result.confidence
+    full = np.stack([full_result.eig_min, full_result.eig_max], axis=-1)
+    decimated = np.stack([result.eig_min, result.eig_max], axis=-1)[nearest]
+    return {
+        "direction_error": float(np.sum(confidence * angle) / max(np.sum(confidence), 1e-300)),
+        "curvature_error": float(np.sqrt(np.mean((decimated - full)**2) / max(np.mean(full**2), 1e-300))),
+    }
@@ -0,0 +1,125 @@
+"""
+Export-time optimizations of mesh assets.
+
+Triangles are reordered for the GPU's post-transform vertex cache with
+Tipsify (Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex
+Locality and Reduced Overdraw", 2007), then vertices are renumbered in the
+order the triangles first use them, for fetch locality. acmr() measures the
+average cache miss ratio (transformed vertices per triangle) of a FIFO cache.
+
+Attributes can be quantized for download size: unit vectors to two int16
+with the octahedral mapping (under 1e-4 rad of error), positions to uint16
+fixed point within their bounding box.
+"""
+import numpy as np
+
+CACHE_SIZE = 16
+
+def acmr(triangles, cache_size=CACHE_SIZE):
+    """Average cache miss ratio of drawing triangles with a FIFO vertex cache."""
+    triangles = np.asarray(triangles)
+    if len(triangles) == 0:
+        return 0.0
+    # a vertex is cached while fewer than cache_size misses followed its own
+    stamps = {}
+    misses = 0
+    for v in triangles.ravel().tolist():
+        if misses - stamps.get(v, -cache_size - 1) > cache_size:
+            stamps[v] = misses
+            misses += 1
+    return misses / len(triangles)
+
+def tipsify(triangles, num_vertices, cache_size=CACHE_SIZE):
+    """Triangle order of Tipsify, as an array of face indices."""
+    triangles = np.asarray(triangles)
+    corners = triangles.ravel()
+    offsets = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(corners, minlength=num_vertices), out=offsets[1:])
+    faces = (np.argsort(corners, kind="stable") // 3).tolist()
+    offsets = offsets.tolist()
+    tris = triangles.tolist()
+
+    live = np.diff(offsets).tolist()
+    stamps = [-cache_size - 1] * num_vertices
+    emitted = [False] * len(tris)
+    order = []
+    dead_end = []
+    time = 0
+    cursor = 0
+    fan = 0 if tris else -1
+    while fan >= 0:
+        candidates = []
+        for face in faces[offsets[fan]:offsets[fan + 1]]:
+            if emitted[face]:
+                continue
+            emitted[face] = True
+            order.append(face)
+            for v in tris[face]:
+                dead_end.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamps[v] > cache_size:
+                    stamps[v] = time
+                    time += 1
+
+        # the candidate still in the cache after emitting its remaining
+        # triangles, and longest in it; else a recent dead end; else the
+        # next vertex in input order with triangles left
+        fan, best = -1, -1
+        for v in candidates:
+            if live[v] > 0:
+                age = time - stamps[v]
+                priority = age if age + 2 * live[v] <= cache_size else 0
+                if priority > best:
+                    fan, best = v, priority
+        while fan < 0 and dead_end:
+            v = dead_end.pop()
+            if live[v] > 0:
+                fan = v
+        while fan < 0 and cursor < num_vertices:
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+    return np.array(order, dtype=np.int64)
+
+def first_use_order(triangles, num_vertices):
+    """Vertices in the order triangles first reference them, then the unreferenced ones."""
+    used, first = np.unique(np.asarray(triangles).ravel(), return_index=True)
+    unused = np.setdiff1d(np.arange(num_vertices), used)
+    return np.concatenate([used[np.argsort(first)], unused])
+
+def reorder_mesh(triangles, num_vertices, cache_size=CACHE_SIZE):
+    """
+    Tipsify the triangles and renumber the vertices by first use. Returns
+    the old index of each new vertex, and the new triangles.
+    """
+    triangles = np.asarray(triangles)[tipsify(triangles, num_vertices, cache_size)]
+    vertex_order = first_use_order(triangles, num_vertices)
+    new_index = np.empty(num_vertices, dtype=np.int64)
+    new_index[vertex_order] = np.arange(num_vertices)
+    return vertex_order, new_index[triangles].astype(triangles.dtype)
+
+def encode_octahedral(vectors):
+    """Unit vectors (n, 3) to int16 octahedral coordinates (n, 2)."""
+    vectors = np.asarray(vectors, dtype=np.float64)
+    p = vectors[:,:2] / np.maximum(np.abs(vectors).sum(axis=-1, keepdims=True), 1e-12)
+    sign = np.where(p >= 0, 1.0, -1.0)
+    folded = (1 - np.abs(p[:,::-1])) * sign
+    p = np.where(vectors[:,2:] < 0, folded, p)
+    return np.round(np.clip(p, -1, 1) * 32767).astype(np.int16)
+
+def decode_octahedral(encoded):
+    p = np.asarray(encoded, dtype=np.float64) / 32767
+    z = 1 - np.abs(p).sum(axis=-1)
+    t = np.maximum(-z, 0)[:,None]
+    xy = p - np.where(p >= 0, t, -t)
+    vectors = np.concatenate([xy, z[:,None]], axis=-1)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def encode_fixed(points, low, high):
+    """Points to uint16 fixed point within the box [low, high]."""
+    extent = np.where(high > low, high - low, 1)
+    return np.round((np.asarray(points) - low) / extent * 65535).astype(np.uint16)
+
+def decode_fixed(encoded, low, high):
+    return low + np.asarray(encoded, dtype=np.float64) / 65535 * (high - low)
@@ -0,0 +1,33 @@
+"""
+Vector and tangent frame helpers shared by the mesh estimators and SDF
+curvature (curvature.py) and the point cloud fits (pointcloud.py).
+"""
+import numpy as np
+
+def normalize(p):
+    lenp = np.linalg.norm(p, axis=-1, keepdims=True)
+    return p / np.maximum(lenp, 1e-8)
+
+def compute_tangent_frames(normals):
+    # cross each normal with the coordinate axis it is least aligned with
+    axes = np.zeros_like(normals)
+    axes[np.arange(normals.shape[0]), np.argmin(np.abs(normals), axis=-1)] = 1
+    coordinates = np.zeros(normals.shape[:1] + (3, 3), dtype=normals.dtype)
+    coordinates[:,0,:] = normalize(np.cross(axes, normals))
+    coordinates[:,1,:] = normals
+    coordinates[:,2,:] = normalize(np.cross(coordinates[:,0,:], coordinates[:,1,:]))
+    return coordinates
+
+def principal_curvatures_2x2(L, M, N):
+    # closed form eigen decomposition of [[L, M], [M, N]]; the eigenvector of
+    # the larger eigenvalue is at angle theta, the other is perpendicular
+    mean = (L + N) / 2
+    radius = np.hypot((L - N) / 2, M)
+    theta = 0.5 * np.arctan2(2 * M, L - N)
+    return mean - radius, mean + radius, np.cos(theta), np.sin(theta)
+
+def principal_directions(cos, sin, u, v):
+    """Directions (curvature_min, curvature_max) of principal_curvatures_2x2 in the tangent basis u, v."""
+    curvature_max = normalize(cos[:,None] * u + sin[:,None] * v)
+    curvature_min = normalize(-sin[:,None] * u + cos[:,None] * v)
+    return curvature_min, curvature_max
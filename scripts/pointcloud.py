@@ -0,0 +1,192 @@
+"""
+Curvature of point clouds, without reconstructing a mesh.
+
+Each point's neighborhood is its k nearest neighbors in one cKDTree,
+optionally limited to a radius. Unless the input has normals, they are the
+smallest principal axis of each neighborhood (PCA), oriented consistently
+by propagation along a minimum spanning tree of the neighbor graph (from
+the point farthest from the centroid of each connected part, pointing
+outward). The heights of the neighbors over the tangent plane are then fit
+by weighted least squares with
+
+    z = a x^2 + b x y + c y^2 + d x + e y
+
+and the principal curvatures and directions are those of the fitted surface
+at the point, with the same signs as the mesh estimators (positive on a
+sphere with outward normals). The fitted surface normal replaces the input
+one. Neighborhoods and fits run in vectorized chunks on worker processes,
+which receive the tree once, when they start.
+"""
+import contextlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import coo_matrix #pip install scipy
+from scipy.sparse.csgraph import breadth_first_order, minimum_spanning_tree
+from scipy.spatial import cKDTree
+
+from geometry import normalize, compute_tangent_frames, principal_curvatures_2x2, principal_directions
+from profiling import stage
+
+ORIENT_NEIGHBORS = 8
+
+_worker = {}
+
+def _init_worker(tree, neighbors, radius):
+    _worker.update(tree=tree, neighbors=neighbors, radius=radius)
+
+def neighborhoods(points, indices):
+    """Offsets of the neighbors from each point, and weights 0 for missing ones."""
+    tree = _worker["tree"]
+    found = indices < tree.n
+    offsets = tree.data[np.where(found, indices, 0)] - points[:,None]
+    return offsets, found.astype(np.float64)
+
+def pca_normals(offsets, weights):
+    """Smallest principal axis of each neighborhood, unoriented."""
+    total = weights.sum(axis=1)[:,None]
+    mean = np.einsum("mk,mki->mi", weights, offsets) / total
+    centered = offsets - mean[:,None]
+    covariance = np.matmul((centered * weights[...,None]).transpose(0, 2, 1), centered) / total[:,:,None]
+    return np.linalg.eigh(covariance)[1][:,:,0]
+
+def neighbor_chunk(start, stop, pca):
+    """k nearest neighbors (the point itself first, tree.n where missing) and PCA normals."""
+    tree = _worker["tree"]
+    points = tree.data[start:stop]
+    radius = _worker["radius"]
+    _, indices = tree.query(points, k=_worker["neighbors"] + 1,
+        distance_upper_bound=np.inf if radius is None else radius)
+    indices = indices.astype(np.int32)
+    normals = pca_normals(*neighborhoods(points, indices)) if pca else None
+    return indices, normals
+
+def orient_normals(points, normals, indices):
+    """
+    Flip normals consistently along a minimum spanning tree of the graph of
+    the ORIENT_NEIGHBORS nearest neighbors, weighted 1 - |n_i . n_j| so that propagation follows flat regions.
+    A virtual root is linked to every point with a heavier weight that is
+    least at the point farthest from the centroid, so each connected part
+    hangs off its outermost point, whose normal is made to point outward.
+    """
+    n = len(points)
+    indices = indices[:,1:ORIENT_NEIGHBORS + 1]
+    src = np.repeat(np.arange(n), indices.shape[1])
+    dst = indices.ravel()
+    valid = dst < n
+    src, dst = src[valid], dst[valid]
+    weight = 1 - np.abs(np.einsum("ij,ij->i", normals[src], normals[dst])) + 1e-6
+    outward = points - points.mean(axis=0)
+    distance = np.linalg.norm(outward, axis=-1)
+    root_weight = 3 - distance / max(distance.max(), 1e-12)
+    graph = coo_matrix((
+        np.concatenate([weight, root_weight]),
+        (np.concatenate([src, np.full(n, n)]), np.concatenate([dst, np.arange(n)])),
+    ), shape=(n + 1, n + 1))
+    tree = minimum_spanning_tree(graph)
+    _, parents = breadth_first_order(tree, n, directed=False)
+
+    # flip[i]: whether normal i disagrees with its parent's; accumulated up
+    # to the point under the root by pointer jumping, then combined with
+    # whether that point's normal points inward
+    parents = parents[:n]
+    top = (parents == n) | (parents < 0)
+    parents = np.where(top, np.arange(n), parents)
+    inward = np.einsum("ij,ij->i", normals, outward) < 0
+    flip = ~top & (np.einsum("ij,ij->i", normals, normals[parents]) < 0)
+    while np.any(parents[parents] != parents):
+        flip = flip ^ flip[parents]
+        parents = parents[parents]
+    flip = flip ^ inward[parents]
+    return np.where(flip[:,None], -normals, normals)
+
+def fit_curvature(offsets, weights, t1, t2, normals):
+    """
+    Principal curvatures and directions of the quadric fit to each
+    neighborhood (offsets from the point, weights 0 for missing neighbors).
+    """
+    x, y, z = np.matmul(offsets, np.stack([t1, t2, normals], axis=-1)).transpose(2, 0, 1)
+    # fit in units of the neighborhood size, for conditioning
+    scale = np.maximum(np.sqrt(np.max(weights * (x**2 + y**2), axis=1)), 1e-12)[:,None]
+    x, y, z = x / scale, y / scale, z / scale
+    design = np.stack([x * x, x * y, y * y, x, y], axis=-1)
+    weighted = (design * weights[...,None]).transpose(0, 2, 1)
+    ata = np.matmul(weighted, design) + 1e-9 * np.eye(5)
+    atz = np.matmul(weighted, z[...,None])
+    a, b, c, d, e = np.linalg.solve(ata, atz)[...,0].T
+    scale = scale[:,0]
+    a, b, c = a / scale, b / scale, c / scale
+
+    # first and second fundamental forms of the fitted surface at the origin
+    E, F, G = 1 + d * d, d * e, 1 + e * e
+    w = np.sqrt(1 + d * d + e * e)
+    L, M, N = 2 * a / w, b / w, 2 * c / w
+    r_x = t1 + d[:,None] * normals
+    r_y = t2 + e[:,None] * normals
+    # orthonormal tangent basis by Gram-Schmidt (Cholesky of the first form)
+    r11 = np.sqrt(E)
+    r12 = F / r11
+    r22 = np.sqrt(G - r12 * r12)
+    e1 = r_x / r11[:,None]
+    e2 = (r_y - r12[:,None] * e1) / r22[:,None]
+    p11, p12, p22 = 1 / r11, -r12 / (r11 * r22), 1 / r22
+    # shape operator in that basis, negated so that the fit normal points outward
+    h11 = -p11 * p11 * L
+    h12 = -p11 * (p12 * L + p22 * M)
+    h22 = -(p12 * p12 * L + 2 * p12 * p22 * M + p22 * p22 * N)
+
+    eig_min, eig_max, cos, sin = principal_curvatures_2x2(h11, h12, h22)
+    curvature_min, curvature_max = principal_directions(cos, sin, e1, e2)
+    fitted_normals = normalize(np.cross(e1, e2))
+    return fitted_normals, curvature_min, curvature_max, eig_min, eig_max
+
+def curvature_chunk(start, stop, indices, normals):
+    points = _worker["tree"].data[start:stop]
+    offsets, weights = neighborhoods(points, indices)
+    normals = normalize(normals)
+    # right handed (t1, t2, n), so that the fitted normal keeps its side
+    coordinates = compute_tangent_frames(normals)
+    t1, t2 = coordinates[:,0], -coordinates[:,2]
+    result = fit_curvature(offsets, weights, t1, t2, normals)
+    # too few neighbors for the five coefficients: keep the normal, no curvature
+    sparse = weights.sum(axis=1) < 6
+    if sparse.any():
+        result[0][sparse] = normals[sparse]
+        result[1][sparse], result[2][sparse] = t1[sparse], t2[sparse]
+        result[3][sparse] = result[4][sparse] = 0
+    return result
+
+def pointcloud_curvature(points, normals=None, neighbors=20, radius=None, workers=None, chunk_size=20000):
+    """
+    Normals (n, 3), principal curvature directions (n, 3) and curvatures
+    (n,) of a point cloud, as (normals, curvature_min, curvature_max,
+    eig_min, eig_max). Pass the input normals, if any, to use them instead
+    of PCA. workers=None uses one process per core, 1 runs in this process.
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    n = len(points)
+    if n == 0:
+        return tuple(np.zeros((0, 3)) for _ in range(3)) + (np.zeros(0), np.zeros(0))
+    with stage("kdtree", points=n):
+        tree = cKDTree(points)
+    initargs = (tree, neighbors, radius)
+    starts = list(range(0, n, chunk_size))
+    stops = [min(start + chunk_size, n) for start in starts]
+    workers = min(workers or os.cpu_count(), len(starts))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) \
+            if workers > 1 else contextlib.nullcontext() as pool:
+        if pool is None:
+            _init_worker(*initargs)
+        map_chunks = map if pool is None else pool.map
+
+        with stage("neighbors", points=n, neighbors=n * neighbors):
+            pca = [normals is None] * len(starts)
+            indices, pca_chunks = zip(*map_chunks(neighbor_chunk, starts, stops, pca))
+        if normals is None:
+            with stage("orient", points=n):
+                normals = orient_normals(points, np.concatenate(pca_chunks), np.concatenate(indices))
+        with stage("fit", points=n):
+            normal_chunks = [normals[start:stop] for start, stop in zip(starts, stops)]
+            chunks = list(map_chunks(curvature_chunk, starts, stops, indices, normal_chunks))
+    return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
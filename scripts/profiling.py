@@ -0,0 +1,108 @@
+"""
+Per-stage instrumentation of the curvature pipeline.
+
+Library code marks its stages with
+
+    with stage("topology", vertices=n) as record:
+        ...
+        record["edges"] = m
+
+which costs next to nothing unless a profiler is active. A caller collects
+the stages of everything it runs with
+
+    with profile() as profiler:
+        curvature.run(args)
+    print(profiler.format_table())
+    report = profiler.report()
+
+Each stage records calls, wall time, CPU time (process wide, so threads
+count), the peak of traced memory above its starting point and the element
+counts passed to it. Nested stages are reported under their parent's path,
+e.g. "curvature/eigensolve".
+"""
+import contextlib
+import json
+import time
+import tracemalloc
+
+_active = []
+
+class Profiler:
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stages = {}
+        self.stack = []
+
+    def enter(self, name):
+        path = "/".join([frame["path"] for frame in self.stack[-1:]] + [name])
+        self.stages.setdefault(path, {
+            "stage": path, "calls": 0, "wall": 0.0, "cpu": 0.0, "peak_bytes": 0, "counts": {},
+        })
+        frame = {"path": path, "wall": time.perf_counter(), "cpu": time.process_time()}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["memory"] = frame["peak"] = current
+        self.stack.append(frame)
+        return frame
+
+    def exit(self, frame, counts):
+        self.stack.pop()
+        record = self.stages[frame["path"]]
+        record["calls"] += 1
+        record["wall"] += time.perf_counter() - frame["wall"]
+        record["cpu"] += time.process_time() - frame["cpu"]
+        if self.memory:
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            record["peak_bytes"] = max(record["peak_bytes"], peak - frame["memory"])
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+        for key, value in counts.items():
+            record["counts"][key] = record["counts"].get(key, 0) + value
+
+    def report(self):
+        """List of stage records, in the order the stages were first entered."""
+        return [dict(record, counts=dict(record["counts"])) for record in self.stages.values()]
+
+    def format_table(self):
+        lines = ["{:<36} {:>6} {:>10} {:>10} {:>11}  {}".format("stage", "calls", "wall s", "cpu s", "peak MiB", "counts")]
+        for record in self.stages.values():
+            depth = record["stage"].count("/")
+            name = "  " * depth + record["stage"].rsplit("/", 1)[-1]
+            counts = " ".join("{}={}".format(key, value) for key, value in record["counts"].items())
+            lines.append("{:<36} {:>6} {:>10.4f} {:>10.4f} {:>11.1f}  {}".format(
+                name, record["calls"], record["wall"], record["cpu"], record["peak_bytes"] / 2**20, counts))
+        return "\n".join(lines)
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+@contextlib.contextmanager
+def profile(memory=True):
+    """Collect the stages run inside the block; memory=False skips tracemalloc (and its overhead)."""
+    profiler = Profiler(memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _active.append(profiler)
+    try:
+        yield profiler
+    finally:
+        _active.remove(profiler)
+        if started:
+            tracemalloc.stop()
+
+@contextlib.contextmanager
+def stage(name, **counts):
+    if not _active:
+        yield counts
+        return
+    profiler = _active[-1]
+    frame = profiler.enter(name)
+    try:
+        yield counts
+    finally:
+        profiler.exit(frame, counts)
@@ -0,0 +1,375 @@
+import numpy as np
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Signed distance scenes, described as a tree of JSON nodes:
+#
+#   {"type": "sphere", "radius": r}
+#   {"type": "box", "size": [bx, by, bz]}                     (half extents)
+#   {"type": "cylinder", "radius": r, "center": [c0, c1], "axes": [a0, a1]}
+#       infinite cylinder along the remaining axis, through (c0, c1) in the
+#       plane of the axes a0, a1 (default [0, 2], i.e. along y)
+#   {"type": "torus", "radii": [R, r]}                        (in the xz plane)
+#   {"type": "translate", "offset": [x, y, z], "child": node}
+#   {"type": "scale", "factor": s, "child": node}
+#   {"type": "permute", "axes": [a0, a1, a2], "child": node}  (p -> p[axes])
+#   {"type": "union" | "intersection" | "difference", "children": [nodes]}
+#   {"type": "smooth_union", "k": k, "children": [nodes]}
+#
+# Difference subtracts every later child from the first one. A scene is
+# compiled once into a Plan: a flat list of in-place NumPy steps over a
+# fixed set of numbered buffers, so evaluating it allocates no temporaries
+# beyond those buffers, however many nodes the scene has.
+#
+# Primitives follow
+# https://iquilezles.org/www/articles/distfunctions/distfunctions.htm
+
+SCENE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenes")
+
+EXAMPLES = {
+    1: os.path.join(SCENE_DIR, "torus.json"),
+    2: os.path.join(SCENE_DIR, "csg.json"),
+}
+
+def load_scene(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def compile_scene(scene):
+    return Plan(scene)
+
+class Plan:
+    """
+    Compiled scene. Calling plan(pos) with pos of shape (..., 3) returns the
+    signed distances, in the dtype of pos. Buffer 0 holds the result (out,
+    if given); the scratch buffers above it are kept per thread and per
+    shape, and are reused by every node: a node evaluated into buffer i
+    only uses buffers above i, and those are free again once it is done.
+    """
+
+    def __init__(self, scene):
+        self.steps = []
+        self.num_buffers = 1
+        self.num_positions = 0
+        self._local = threading.local()
+        self.emit(scene, 0, (("x", 0), ("x", 1), ("x", 2)), 0)
+
+    def __call__(self, pos, out=None):
+        shape = pos.shape[:-1]
+        if out is None:
+            out = np.empty(shape, dtype=pos.dtype)
+        buffers, positions = self.scratch(shape, pos.dtype)
+        d = [out] + buffers
+        x = (pos[...,0], pos[...,1], pos[...,2])
+        for step in self.steps:
+            step(d, positions, x)
+        return out
+
+    def scratch(self, shape, dtype):
+        key = (shape, np.dtype(dtype))
+        cached = getattr(self._local, "scratch", None)
+        if cached is None or cached[0] != key:
+            buffers = [np.empty(shape, dtype=dtype) for _ in range(self.num_buffers - 1)]
+            positions = [np.empty(shape, dtype=dtype) for _ in range(self.num_positions)]
+            cached = self._local.scratch = (key, buffers, positions)
+        return cached[1], cached[2]
+
+    def buffer(self, i):
+        self.num_buffers = max(self.num_buffers, i + 1)
+        return i
+
+    def position(self, i):
+        self.num_positions = max(self.num_positions, i + 1)
+        return ("p", i)
+
+    def emit(self, node, out, pos, top):
+        """Append the steps computing node at positions pos into buffer out."""
+        kind = node["type"]
+        if kind in PRIMITIVES:
+            self.steps.append(PRIMITIVES[kind](self, node, out, [getter(ref) for ref in pos]))
+        elif kind in TRANSFORMS:
+            TRANSFORMS[kind](self, node, out, pos, top)
+        elif kind in OPERATORS:
+            children = node["children"]
+            if not children:
+                raise ValueError("{} without children".format(kind))
+            self.emit(children[0], out, pos, top)
+            for child in children[1:]:
+                self.emit(child, self.buffer(out + 1), pos, top)
+                self.steps.append(OPERATORS[kind](self, node, out))
+        else:
+            raise ValueError("unknown sdf node type {!r}".format(kind))
+
+def getter(ref):
+    kind, i = ref
+    if kind == "x":
+        return lambda p, x: x[i]
+    return lambda p, x: p[i]
+
+def emit_sphere(plan, node, out, pos):
+    r = float(node["radius"])
+    t = plan.buffer(out + 1)
+    px, py, pz = pos
+    def step(d, p, x):
+        o, s = d[out], d[t]
+        np.multiply(px(p, x), px(p, x), out=o)
+        o += np.multiply(py(p, x), py(p, x), out=s)
+        o += np.multiply(pz(p, x), pz(p, x), out=s)
+        np.sqrt(o, out=o)
+        o -= r
+    return step
+
+def emit_box(plan, node, out, pos):
+    b = [float(v) for v in node["size"]]
+    t = [plan.buffer(out + i) for i in (1, 2, 3, 4)]
+    def step(d, p, x):
+        o, s = d[out], d[t[3]]
+        q = [d[t[i]] for i in range(3)]
+        for i in range(3):
+            np.abs(pos[i](p, x), out=q[i])
+            q[i] -= b[i]
+        np.maximum(q[0], 0, out=o)
+        o *= o
+        for i in (1, 2):
+            np.maximum(q[i], 0, out=s)
+            s *= s
+            o += s
+        np.sqrt(o, out=o)
+        np.maximum(q[0], q[1], out=s)
+        np.maximum(s, q[2], out=s)
+        o += np.minimum(s, 0, out=s)
+    return step
+
+def emit_cylinder(plan, node, out, pos):
+    r = float(node["radius"])
+    c0, c1 = [float(v) for v in node.get("center", (0.0, 0.0))]
+    a0, a1 = node.get("axes", (0, 2))
+    t = plan.buffer(out + 1)
+    def step(d, p, x):
+        o, s = d[out], d[t]
+        np.subtract(pos[a0](p, x), c0, out=s)
+        np.multiply(s, s, out=o)
+        np.subtract(pos[a1](p, x), c1, out=s)
+        o += np.multiply(s, s, out=s)
+        np.sqrt(o, out=o)
+        o -= r
+    return step
+
+def emit_torus(plan, node, out, pos):
+    R, r = [float(v) for v in node["radii"]]
+    t = plan.buffer(out + 1)
+    px, py, pz = pos
+    def step(d, p, x):
+        o, s = d[out], d[t]
+        np.multiply(px(p, x), px(p, x), out=s)
+        s += np.multiply(pz(p, x), pz(p, x), out=o)
+        np.sqrt(s, out=s)
+        s -= R
+        s *= s
+        s += np.multiply(py(p, x), py(p, x), out=o)
+        np.sqrt(s, out=o)
+        o -= r
+    return step
+
+def emit_translate(plan, node, out, pos, top):
+    pos = list(pos)
+    for axis, offset in enumerate(node["offset"]):
+        if offset == 0:
+            continue
+        src, dst = getter(pos[axis]), plan.position(top)
+        offset, k = float(offset), top
+        plan.steps.append(lambda d, p, x, src=src, k=k, offset=offset: np.subtract(src(p, x), offset, out=p[k]))
+        pos[axis], top = dst, top + 1
+    plan.emit(node["child"], out, tuple(pos), top)
+
+def emit_scale(plan, node, out, pos, top):
+    factor = float(node["factor"])
+    scaled = []
+    for axis in range(3):
+        src, dst = getter(pos[axis]), plan.position(top + axis)
+        k = top + axis
+        plan.steps.append(lambda d, p, x, src=src, k=k: np.divide(src(p, x), factor, out=p[k]))
+        scaled.append(dst)
+    plan.emit(node["child"], out, tuple(scaled), top + 3)
+    plan.steps.append(lambda d, p, x: np.multiply(d[out], factor, out=d[out]))
+
+def emit_permute(plan, node, out, pos, top):
+    plan.emit(node["child"], out, tuple(pos[axis] for axis in node["axes"]), top)
+
+def op_union(plan, node, out):
+    return lambda d, p, x: np.minimum(d[out], d[out + 1], out=d[out])
+
+def op_intersection(plan, node, out):
+    return lambda d, p, x: np.maximum(d[out], d[out + 1], out=d[out])
+
+def op_difference(plan, node, out):
+    def step(d, p, x):
+        b = np.negative(d[out + 1], out=d[out + 1])
+        np.maximum(b, d[out], out=d[out])
+    return step
+
+def op_smooth_union(plan, node, out):
+    k = float(node["k"])
+    h, t = plan.buffer(out + 2), plan.buffer(out + 3)
+    def step(d, p, x):
+        d1, d2, hh, tt = d[out], d[out + 1], d[h], d[t]
+        # h = clip(0.5 + 0.5*(d2-d1)/k, 0, 1)
+        np.subtract(d2, d1, out=hh)
+        hh *= 0.5
+        hh /= k
+        hh += 0.5
+        np.clip(hh, 0.0, 1.0, out=hh)
+        # mix(d2, d1, h) - k*h*(1-h)
+        np.subtract(1, hh, out=tt)
+        d2 *= tt
+        d1 *= hh
+        d2 += d1
+        hh *= k
+        hh *= tt
+        np.subtract(d2, hh, out=d1)
+    return step
+
+PRIMITIVES = {
+    "sphere": emit_sphere,
+    "box": emit_box,
+    "cylinder": emit_cylinder,
+    "torus": emit_torus,
+}
+
+TRANSFORMS = {
+    "translate": emit_translate,
+    "scale": emit_scale,
+    "permute": emit_permute,
+}
+
+OPERATORS = {
+    "union": op_union,
+    "intersection": op_intersection,
+    "difference": op_difference,
+    "smooth_union": op_smooth_union,
+}
+
+def sdf_grid_tiled(sdf, n, dtype=np.float64, threads=None, slab=4):
+    """
+    Evaluate sdf on the n x n x n grid of mesh_from_sdf, in slabs of the
+    first grid axis run on a thread pool (NumPy releases the GIL) and
+    written into one preallocated volume. Each slab's coordinates come from
+    the linspace vectors, so besides the output only per-slab scratch is
+    allocated. A compiled Plan writes straight into the volume.
+    """
+    x = np.linspace(-2, 2, n, dtype=dtype)
+    grid = np.empty((n, n, n), dtype=dtype)
+
+    # grid[i, j, k] holds the value at (x[j], y[i], z[k]), as with np.meshgrid
+    def evaluate(i0):
+        i1 = min(i0 + slab, n)
+        pos = np.empty((i1 - i0, n, n, 3), dtype=dtype)
+        pos[...,0] = x[None,:,None]
+        pos[...,1] = x[i0:i1,None,None]
+        pos[...,2] = x[None,None,:]
+        if isinstance(sdf, Plan):
+            sdf(pos, out=grid[i0:i1])
+        else:
+            grid[i0:i1] = sdf(pos)
+
+    with ThreadPoolExecutor(threads or os.cpu_count()) as pool:
+        list(pool.map(evaluate, range(0, n, slab)))
+    return grid
+
+def sdf_grid_adaptive(sdf, n, dtype=np.float64, min_block=4, lipschitz=1.0, batch=4096):
+    """
+    Evaluate sdf on the same n x n x n grid as mesh_from_sdf, but only in a
+    narrow band around its zero level set.
+
+    Blocks of the grid are refined from one block covering everything down
+    to min_block cells. A block whose center value satisfies
+    |d| > lipschitz * (half diagonal) cannot contain the surface, so all of
+    its points share the sign of d and are simply filled with d. Only the
+    blocks left at the finest level are evaluated point by point, so every
+    grid edge crossing the surface gets exact values at both ends and
+    marching cubes produces the same mesh as on the dense grid.
+    """
+    x = np.linspace(-2, 2, n, dtype=dtype)
+    h = 4 / (n - 1)
+    grid = np.empty((n, n, n), dtype=dtype)
+    corners = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+
+    # grid[i, j, k] holds the value at (x[j], y[i], z[k]), as with np.meshgrid
+    size = 1 << int(np.ceil(np.log2(n - 1)))
+    origins = np.zeros((1, 3), dtype=np.int64)
+    while True:
+        ends = np.minimum(origins + size, n - 1)
+        center = (-2 + (origins + ends)[:,[1,0,2]] * h / 2).astype(dtype)
+        radius = np.linalg.norm(ends - origins, axis=-1) * h / 2
+        d = sdf(center)
+        far = np.abs(d) > lipschitz * radius * (1 + 1e-6)
+        for (i0, j0, k0), (i1, j1, k1), value in zip(origins[far], ends[far], d[far]):
+            grid[i0:i1+1, j0:j1+1, k0:k1+1] = value
+        origins = origins[~far]
+        if size <= min_block:
+            break
+        size //= 2
+        origins = (origins[:,None,:] + size * corners).reshape(-1, 3)
+        origins = origins[np.all(origins < n - 1, axis=-1)]
+
+    offsets = np.stack(np.meshgrid(*[np.arange(size + 1)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    for start in range(0, origins.shape[0], batch):
+        idx = np.minimum(origins[start:start + batch,None,:] + offsets, n - 1)
+        pos = np.stack([x[idx[...,1]], x[idx[...,0]], x[idx[...,2]]], axis=-1)
+        grid[idx[...,0], idx[...,1], idx[...,2]] = sdf(pos)
+    return grid
+
+def grid_to_scene(points, n):
+    """
+    Scene coordinates of points in the index space of the n x n x n grid,
+    where marching cubes puts its vertices: index (i, j, k) is the point
+    (x[j], y[i], z[k]). Swapping the first two components is its own
+    inverse, and maps vectors between the two spaces too.
+    """
+    return -2 + 4 / (n - 1) * points[...,[1,0,2]]
+
+def scene_to_grid(points, n):
+    return (points[...,[1,0,2]] + 2) * ((n - 1) / 4)
+
+def _stencil():
+    offsets = [(0, 0, 0)]
+    for i in range(3):
+        offsets += [tuple(s * (a == i) for a in range(3)) for s in (1, -1)]
+    for i in range(3):
+        for j in range(i + 1, 3):
+            offsets += [tuple(si * (a == i) + sj * (a == j) for a in range(3)) for si in (1, -1) for sj in (1, -1)]
+    return np.array(offsets, dtype=np.float64)
+
+# the point, +-e_i (1..6), then +-e_i +-e_j for i < j in the order (++, +-, -+, --)
+STENCIL = _stencil()
+
+def sdf_derivatives(sdf, pos, eps=1e-3, hessian=True):
+    """
+    Values (m,), gradients (m, 3) and, with hessian, Hessians (m, 3, 3) of
+    sdf at pos (m, 3) by central differences of step eps, evaluated with a
+    single call of sdf on all stencil points.
+    """
+    stencil = STENCIL if hessian else STENCIL[:7]
+    d = sdf(pos[:,None,:] + eps * stencil)
+    value = d[:,0]
+    gradient = (d[:,1:7:2] - d[:,2:7:2]) / (2 * eps)
+    if not hessian:
+        return value, gradient
+    H = np.empty((len(pos), 3, 3), dtype=d.dtype)
+    H[:,[0,1,2],[0,1,2]] = (d[:,1:7:2] + d[:,2:7:2] - 2 * value[:,None]) / eps**2
+    k = 7
+    for i in range(3):
+        for j in range(i + 1, 3):
+            pp, pm, mp, mm = d[:,k:k+4].T
+            H[:,i,j] = H[:,j,i] = (pp - pm - mp + mm) / (4 * eps**2)
+            k += 4
+    return value, gradient, H
+
+def snap_to_surface(sdf, pos, steps=3, eps=1e-3):
+    """Move points onto the zero level set with Newton steps along the gradient."""
+    for _ in range(steps):
+        d, g = sdf_derivatives(sdf, pos, eps, hessian=False)
+        pos = pos - (d / np.maximum(np.einsum("ij,ij->i", g, g), 1e-12))[:,None] * g
+    return pos
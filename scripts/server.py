@@ -0,0 +1,246 @@
+"""
+Local curvature service for the mesh viewer.
+
+Keeps loaded meshes, decimated meshes (with their normals and topology),
+curvature results and encoded assets in memory, in a least recently used
+cache of bounded size, so that re-requesting a mesh with other parameters
+only recomputes what changed. Requests are GETs taking curvature.py options
+as query parameters (flags as true/false, --output is not needed), e.g.
+
+    /curvature?source=model&input=../models/bunny_1k.obj&target_num=5000&estimator=taubin&format=binary
+
+and are answered with the asset curvature.py would write. Paths are relative
+to the directory the server runs in. /stats reports the cache contents.
+
+    python server.py [--port 8765] [--cache_size 1024]
+
+The Vite dev server proxies /api to it, see vite.config.js.
+"""
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import curvature
+from build import job_argv
+
+UNSUPPORTED_OPTIONS = ("output", "tiles", "cache", "cache_size", "vis", "profile", "profile_output", "fidelity")
+
+def nbytes(value):
+    """Approximate memory held by the arrays in value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if hasattr(value, "__dict__"):
+        return nbytes(vars(value))
+    return 0
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.hits = self.misses = 0
+
+    def get(self, key, compute):
+        """Return the value cached under key, or compute and cache it."""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        self.misses += 1
+        value = compute()
+        size = nbytes(value)
+        self.entries[key] = (value, size)
+        self.total += size
+        # never evict the entry just added, even if it is over the limit alone
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.total -= evicted
+        return value
+
+    def stats(self):
+        return {
+            "entries": [{"key": key, "bytes": size} for key, (_, size) in self.entries.items()],
+            "bytes": self.total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+def file_stamp(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+class CurvatureService:
+    """
+    Answers curvature requests from four cache levels: the loaded source mesh,
+    the decimated and centered mesh (or levels of detail), its curvature per
+    estimator, and the encoded asset. Requests are served one at a time.
+    """
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_bytes)
+        self.lock = threading.Lock()
+
+    def parse(self, query):
+        job = {}
+        for name, value in parse_qsl(query):
+            if name in UNSUPPORTED_OPTIONS:
+                raise ValueError("option {} is not supported by the service".format(name))
+            if name == "estimator":
+                if value not in ("taubin", "rusinkiewicz"):
+                    raise ValueError("unknown estimator {!r}, use taubin or rusinkiewicz".format(value))
+                name, value = "taubin", value == "taubin"
+            elif value in ("true", "false"):
+                value = value == "true"
+            job[name] = value
+        try:
+            args = curvature.build_parser().parse_args(job_argv(job) + ["--output", "-"])
+        except SystemExit:
+            raise ValueError("invalid options {}".format(query))
+        if args.source == "pointcloud" or args.analytic:
+            raise ValueError("point clouds and --analytic are not supported by the service")
+        if args.quantize and args.format != "binary":
+            raise ValueError("quantize needs format=binary")
+        if args.smooth is not None and args.smooth_radius is not None:
+            raise ValueError("smooth and smooth_radius are exclusive")
+        if len(args.smooth or args.smooth_radius or []) > 1:
+            raise ValueError("the service smooths at one scale per request")
+        return args
+
+    def source_key(self, args):
+        if args.source == "model":
+            return ["source", "model", file_stamp(args.input)]
+        scene = file_stamp(args.scene) if args.scene is not None else args.example
+        return ["source", "sdf", scene, args.resolution, args.precision, args.adaptive]
+
+    def mesh_key(self, args):
+        key = [self.source_key(args), args.precision, args.simplify_mode, args.curvature_weight]
+        if args.lods is not None:
+            return ["levels"] + key + [args.lods]
+        return ["mesh"] + key + [args.target_num if args.simplify else None]
+
+    def source(self, args):
+        def load():
+            mesh = curvature.load_source(args)
+            return np.array(mesh.vertices), np.array(mesh.triangles)
+        vertices, triangles = self.cache.get(json.dumps(self.source_key(args)), load)
+        # a fresh Open3D mesh, since simplification and centering modify it
+        return curvature.Mesh.from_arrays(vertices, triangles).o3d
+
+    def meshes(self, args):
+        """Levels of detail, or a one-element list, with normals and topology."""
+        def load():
+            if args.lods is not None:
+                meshes = curvature.load_levels(args, source=self.source(args))
+            else:
+                meshes = [curvature.load_mesh(args, source=self.source(args))]
+            if args.precision != "float64":
+                meshes = [mesh.astype(np.dtype(args.precision)) for mesh in meshes]
+            for mesh in meshes:
+                mesh.normals, mesh.topology
+            return meshes
+        return self.cache.get(json.dumps(self.mesh_key(args)), load)
+
+    def curvatures(self, args):
+        def compute():
+            return [curvature.mesh_curvature(mesh, args) for mesh in self.meshes(args)]
+        def smooth():
+            return [curvature.smoothed_curvatures(mesh, result, args)[0]
+                for mesh, result in zip(self.meshes(args), unsmoothed)]
+        key = ["curvature", self.mesh_key(args), args.taubin]
+        unsmoothed = self.cache.get(json.dumps(key), compute)
+        if args.smooth is None and args.smooth_radius is None:
+            return unsmoothed
+        return self.cache.get(json.dumps(key + [args.smooth, args.smooth_radius]), smooth)
+
+    def asset(self, args):
+        def encode():
+            binary = args.format == "binary"
+            f = io.BytesIO() if binary else io.StringIO()
+            meshes, curvatures = self.meshes(args), self.curvatures(args)
+            if args.lods is not None:
+                curvature.write_levels(meshes, curvatures, f, binary=binary, reorder=args.reorder, quantize=args.quantize)
+            else:
+                curvature.write_data(meshes[0], f, binary=binary, curvature=curvatures[0], reorder=args.reorder, quantize=args.quantize)
+            return f.getvalue() if binary else f.getvalue().encode()
+        key = ["asset", self.mesh_key(args), args.taubin, args.smooth, args.smooth_radius, args.format, args.reorder, args.quantize]
+        return self.cache.get(json.dumps(key), encode)
+
+    def handle(self, path):
+        """Return (status, content type, body) for a request path."""
+        url = urlsplit(path)
+        with self.lock:
+            if url.path == "/stats":
+                return 200, "application/json", json.dumps(self.cache.stats(), indent=2).encode()
+            if url.path != "/curvature":
+                return 404, "text/plain", b"not found"
+            try:
+                args = self.parse(url.query)
+                body = self.asset(args)
+            except (ValueError, OSError) as e:
+                return 400, "text/plain", str(e).encode()
+            except Exception as e:
+                # answer anyway, or the proxy only sees the connection drop
+                return 500, "text/plain", "{}: {}".format(type(e).__name__, e).encode()
+        content_type = "application/octet-stream" if args.format == "binary" else "application/json"
+        return 200, content_type, body
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            start = time.perf_counter()
+            status, content_type, body = service.handle(self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-Elapsed", "{:.4f}".format(time.perf_counter() - start))
+            self.end_headers()
+            self.wfile.write(body)
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        default = "127.0.0.1",
+        type = str,
+        help = "address to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        default = 8765,
+        type = int,
+        help = "port to listen on"
+    )
+    parser.add_argument(
+        "--cache_size",
+        default = 1024,
+        type = int,
+        help = "in-memory cache size limit in MiB (least recently used entries are evicted)"
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(CurvatureService(args.cache_size << 20)))
+    print("serving curvature on http://{}:{}/curvature".format(args.host, args.port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
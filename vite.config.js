@@ -4,6 +4,15 @@ import { resolve } from "path";
  * @type {import('vite').UserConfig}
  */
 const config = {
+  server: {
+    proxy: {
+      // Local curvature service, started with `python scripts/server.py`.
+      "/api": {
+        target: "http://127.0.0.1:8765",
+        rewrite: (path) => path.replace(/^\/api/, ""),
+      },
+    },
+  },
   build: {
     minify: "esbuild",
     rollupOptions: {